@@ -0,0 +1,110 @@
+'''
+Realistic Thor responses and Ethereum inputs for the microbenchmarks, built deterministically.
+'''
+import random
+
+
+def _hex(rng, size):
+    return "0x" + bytes(rng.getrandbits(8) for _ in range(size)).hex()
+
+
+def _calldata(rng, size):
+    # ABI encoded arguments are mostly zero padding
+    return "0x" + bytes(rng.getrandbits(8) if rng.random() < 0.3 else 0 for _ in range(size)).hex()
+
+
+def thor_block(txs=0, seed=1):
+    rng = random.Random(seed)
+    return {
+        "number": 2500000,
+        "id": _hex(rng, 32),
+        "size": 240 + 120 * txs,
+        "parentID": _hex(rng, 32),
+        "timestamp": 1550000000,
+        "gasLimit": 10000000,
+        "beneficiary": _hex(rng, 20),
+        "gasUsed": 21000 * txs,
+        "totalScore": 246913578,
+        "txsRoot": _hex(rng, 32),
+        "stateRoot": _hex(rng, 32),
+        "receiptsRoot": _hex(rng, 32),
+        "signer": _hex(rng, 20),
+        "isTrunk": True,
+        "transactions": [_hex(rng, 32) for _ in range(txs)],
+    }
+
+
+def thor_meta(rng):
+    return {
+        "blockID": _hex(rng, 32),
+        "blockNumber": 2500000,
+        "blockTimestamp": 1550000000,
+        "txID": _hex(rng, 32),
+        "txOrigin": _hex(rng, 20),
+    }
+
+
+def thor_event(rng, meta=None):
+    event = {
+        "address": _hex(rng, 20),
+        "topics": [_hex(rng, 32) for _ in range(3)],
+        "data": _hex(rng, 64),
+    }
+    if meta is not None:
+        event["meta"] = meta
+    return event
+
+
+def thor_receipt(events=0, seed=2):
+    rng = random.Random(seed)
+    return {
+        "gasUsed": 21000 + 5000 * events,
+        "gasPayer": _hex(rng, 20),
+        "paid": "0x1236efcbcbb340000",
+        "reward": "0x576e189f04f60000",
+        "reverted": False,
+        "meta": thor_meta(rng),
+        "outputs": [{
+            "contractAddress": None,
+            "events": [thor_event(rng) for _ in range(events)],
+            "transfers": [],
+        }],
+    }
+
+
+def thor_logs(count, seed=3):
+    rng = random.Random(seed)
+    meta = thor_meta(rng)
+    return [thor_event(rng, dict(meta, clauseIndex=0)) for _ in range(count)]
+
+
+def thor_tx(data_size=68, seed=4):
+    rng = random.Random(seed)
+    return {
+        "id": _hex(rng, 32),
+        "chainTag": 39,
+        "blockRef": "0x00263f1c2a7e1b5a",
+        "expiration": 720,
+        "clauses": [{"to": _hex(rng, 20), "value": "0x0", "data": _calldata(rng, data_size)}],
+        "gasPriceCoef": 0,
+        "gas": 90000,
+        "origin": _hex(rng, 20),
+        "nonce": "0x8e8d3e9b7c15b3e",
+        "dependsOn": None,
+        "size": 130 + data_size,
+        "meta": thor_meta(rng),
+    }
+
+
+def eth_tx(data_size=68, seed=5):
+    rng = random.Random(seed)
+    return {
+        "from": _hex(rng, 20),
+        "to": _hex(rng, 20),
+        "value": 10 ** 18,
+        "gas": 90000,
+        "data": _calldata(rng, data_size),
+    }
+
+
+PRIVATE_KEY = "dce1443bd2ef0c2631adc1c67e5c93f13dc23a41c18b536effbbdcbcdb96fb65"
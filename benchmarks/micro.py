@@ -0,0 +1,147 @@
+'''
+Microbenchmarks of the conversion and encoding hot paths, reporting ops/sec and the peak
+memory allocated by one operation. Results can be saved as a baseline and compared later,
+failing when a case gets slower, or allocates more, than the tolerance allows.
+
+    PYTHONPATH=. python benchmarks/micro.py
+    PYTHONPATH=. python benchmarks/micro.py --save baseline.json
+    PYTHONPATH=. python benchmarks/micro.py --compare baseline.json --tolerance 0.1
+    PYTHONPATH=. python benchmarks/micro.py --filter receipt
+'''
+import json
+import sys
+import timeit
+import tracemalloc
+import click
+import rlp
+import fixtures
+from gear.utils.compat import (
+    thor_block_convert_to_eth_block,
+    thor_receipt_convert_to_eth_receipt,
+    thor_log_convert_to_eth_log,
+    thor_tx_convert_to_eth_tx,
+    data_gas,
+    ThorTransaction,
+)
+from gear.utils.types import (
+    encode_number,
+    force_obj_to_text,
+)
+
+
+def _signed(tx):
+    tx.sign(fixtures.PRIVATE_KEY)
+    return tx
+
+
+def cases():
+    empty_block = fixtures.thor_block(0)
+    full_block = fixtures.thor_block(300)
+    receipt = fixtures.thor_receipt(1)
+    busy_receipt = fixtures.thor_receipt(500)
+    logs = fixtures.thor_logs(10000)
+    tx = fixtures.thor_tx()
+    calldata = fixtures.eth_tx(128 * 1024)["data"]
+    eth_tx = fixtures.eth_tx()
+    thor_tx = ThorTransaction(39, 0x263f1c2a, eth_tx)
+    converted_block = thor_block_convert_to_eth_block(full_block)
+    converted_logs = thor_log_convert_to_eth_log(logs[0]["address"], logs)
+    return [
+        ("encode_number small", lambda: encode_number(21000)),
+        ("encode_number 256-bit", lambda: encode_number(2 ** 255 + 1)),
+        ("block empty", lambda: thor_block_convert_to_eth_block(empty_block)),
+        ("block 300 txs", lambda: thor_block_convert_to_eth_block(full_block)),
+        ("block 300 txs to text", lambda: force_obj_to_text(converted_block, True)),
+        ("receipt 1 event", lambda: thor_receipt_convert_to_eth_receipt(receipt)),
+        ("receipt 500 events", lambda: thor_receipt_convert_to_eth_receipt(busy_receipt)),
+        ("logs 10k", lambda: thor_log_convert_to_eth_log(logs[0]["address"], logs)),
+        ("logs 10k to text", lambda: force_obj_to_text(converted_logs, True)),
+        ("tx", lambda: thor_tx_convert_to_eth_tx(tx)),
+        ("data_gas 128KB", lambda: data_gas(calldata)),
+        ("tx rlp encode", lambda: rlp.encode(thor_tx)),
+        ("tx sign", lambda: _signed(ThorTransaction(39, 0x263f1c2a, eth_tx))),
+    ]
+
+
+def ops_per_second(func, repeat=5):
+    timer = timeit.Timer(func)
+    # enough calls for about 0.2s per measurement
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat=repeat, number=number))
+
+
+def peak_allocation(func):
+    '''
+    Peak bytes allocated while running `func` once, which includes its result.
+    '''
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(selected):
+    results = {}
+    for name, func in selected:
+        results[name] = {"ops": ops_per_second(func), "peak": peak_allocation(func)}
+        print("{:<26} {:>14,.1f} ops/s {:>12,d} B peak".format(
+            name, results[name]["ops"], results[name]["peak"]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print the change of each case against `baseline` and return the names that regressed.
+    '''
+    regressions = []
+    print()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        speed = result["ops"] / baseline[name]["ops"] - 1
+        memory = result["peak"] / max(1, baseline[name]["peak"]) - 1
+        regressed = speed < -tolerance or memory > tolerance
+        if regressed:
+            regressions.append(name)
+        print("{:<26} {:>+8.1%} ops/s {:>+8.1%} peak{}".format(
+            name, speed, memory, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+@click.command()
+@click.option(
+    "--save",
+    default="",
+)
+@click.option(
+    "--compare",
+    "baseline_path",
+    default="",
+)
+@click.option(
+    "--tolerance",
+    default=0.1,
+    type=float,
+)
+@click.option(
+    "--filter",
+    "pattern",
+    default="",
+)
+def main(save, baseline_path, tolerance, pattern):
+    results = run([(name, func) for name, func in cases() if pattern in name])
+    if save != "":
+        with open(save, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline_path != "":
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+'''
+Compare the full decode path (`json.loads` + `_attribute` + `force_obj_to_text`) with
+`json_field` on large contract code and call return payloads.
+
+    PYTHONPATH=. python benchmarks/passthrough.py
+'''
+import json
+import os
+import timeit
+from gear.thor.request import json_field
+from gear.utils.types import force_obj_to_text
+
+
+def code_response(size):
+    return json.dumps({"code": "0x" + os.urandom(size).hex()}).encode("utf-8")
+
+
+def call_response(size, events=0):
+    return json.dumps({
+        "data": "0x" + os.urandom(size).hex(),
+        "events": [
+            {"address": "0x" + "00" * 20, "topics": ["0x" + "11" * 32] * 3, "data": "0x" + "22" * 64}
+            for _ in range(events)
+        ],
+        "transfers": [],
+        "gasUsed": 21000,
+        "reverted": False,
+        "vmError": "",
+    }).encode("utf-8")
+
+
+def full_decode(body, key):
+    obj = json.loads(body)
+    return force_obj_to_text(None if obj is None else obj[key], True)
+
+
+CASES = [
+    ("code 24KB", code_response(24 * 1024), "code"),
+    ("call 1KB", call_response(1024), "data"),
+    ("call 256KB", call_response(256 * 1024), "data"),
+    ("call 64KB + 100 events", call_response(64 * 1024, 100), "data"),
+]
+
+
+def main(number=200):
+    for name, body, key in CASES:
+        assert full_decode(body, key) == json_field(body, key)
+        full = min(timeit.repeat(lambda: full_decode(body, key), number=number, repeat=5)) / number
+        lean = min(timeit.repeat(lambda: json_field(body, key), number=number, repeat=5)) / number
+        print("{:<24} full {:>10.1f}us  lean {:>10.1f}us  x{:.1f}".format(name, full * 1e6, lean * 1e6, full / lean))
+
+
+if __name__ == "__main__":
+    main()
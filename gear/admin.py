@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import collections
+import tracemalloc
+from aiohttp import web
+from .utils.thread import offloader
+
+
+# requests being served, by transport
+in_flight = collections.Counter()
+
+
+def _size(container):
+    return None if container is None else len(container)
+
+
+def client_counts(client):
+    counts = {
+        "filters": len(client.filter),
+        "storage_ranges": _size(client.storage_ranges),
+        "trace_cache": _size(client.trace_cache),
+    }
+    if client.trace_cache is not None:
+        counts["trace_cache_bytes"] = client.trace_cache.size
+    if client.receipt_watcher is not None:
+        counts["receipts_pending"] = len(client.receipt_watcher.pending)
+        counts["receipts_kept"] = len(client.receipt_watcher.receipts)
+    if client.prefetcher is not None:
+        counts["prefetched_blocks"] = len(client.prefetcher.blocks)
+        counts["prefetched_txs"] = len(client.prefetcher.txs)
+    if client.call_batcher is not None:
+        counts["calls_batching"] = sum(len(calls) for calls in client.call_batcher.pending.values())
+    return counts
+
+
+def counts(clients, admission=None):
+    '''
+    Sizes of the long-lived containers that grow with traffic.
+    '''
+    result = {
+        "in_flight": dict(in_flight),
+        "networks": {name: client_counts(client) for name, client in clients.items()},
+        "offloader": dict(offloader.stats),
+    }
+    object_caches = {id(c.object_cache): c.object_cache for c in clients.values() if c.object_cache is not None}
+    if object_caches:
+        result["object_cache"] = [{"entries": len(c), "bytes": c.size} for c in object_caches.values()]
+    shared_caches = {id(c.shared_cache): c.shared_cache for c in clients.values() if c.shared_cache is not None}
+    if shared_caches:
+        # counting live entries means scanning the whole index under the host-wide lock
+        result["shared_cache"] = [
+            {"slots": c.entries.slots, "bytes": c.size} for c in shared_caches.values()
+        ]
+    if admission is not None:
+        result["admission"] = {
+            name: {"active": c.active, "queued": c.queued} for name, c in admission.classes.items()
+        }
+    return result
+
+
+class MemoryDiagnostics(object):
+    '''
+    Heap statistics grouped by allocation site from tracemalloc snapshots. Snapshots can be
+    kept under a name, up to `max_snapshots`, to report the growth since then.
+    '''
+
+    def __init__(self, frames=0, max_snapshots=8):
+        super(MemoryDiagnostics, self).__init__()
+        self.max_snapshots = max_snapshots
+        self.snapshots = collections.OrderedDict()
+        if frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def statistics(self, group="lineno", limit=20, save=None, diff=None):
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        snapshot = self.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if diff is not None and diff in self.snapshots:
+            stats = snapshot.compare_to(self.snapshots[diff], group)
+        else:
+            stats = snapshot.statistics(group)
+        if save is not None:
+            self.snapshots.pop(save, None)
+            self.snapshots[save] = snapshot
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+        top = []
+        for stat in stats[:limit]:
+            entry = {
+                "site": [str(frame) for frame in stat.traceback],
+                "size": stat.size,
+                "count": stat.count,
+            }
+            if isinstance(stat, tracemalloc.StatisticDiff):
+                entry["size_diff"] = stat.size_diff
+                entry["count_diff"] = stat.count_diff
+            top.append(entry)
+        return {
+            "tracing": True,
+            "traced": {"current": current, "peak": peak},
+            "snapshots": list(self.snapshots),
+            "diff": diff if diff in self.snapshots else None,
+            "top": top,
+        }
+
+
+async def memory(request, clients, admission, diagnostics):
+    '''
+    GET /admin/memory?group=lineno|filename|traceback&limit=20&save=<name>&diff=<name>
+    '''
+    query = request.query
+    group = query.get("group", "lineno")
+    if group not in ("lineno", "filename", "traceback"):
+        raise web.HTTPBadRequest(text="group must be lineno, filename or traceback")
+    # snapshots of a large heap take a while, keep serving requests meanwhile
+    statistics = await asyncio.get_event_loop().run_in_executor(None, functools.partial(
+        diagnostics.statistics, group, int(query.get("limit", 20)), query.get("save"), query.get("diff")))
+    return web.json_response(dict(statistics, counts=counts(clients, admission)))
+
+
+async def loop(request, watchdog):
+    '''
+    GET /admin/loop
+    '''
+    if watchdog is None:
+        return web.json_response({"watching": False})
+    return web.json_response(dict(watchdog.report(), watching=True))
+
+
+def add_admin_routes(app, clients, admission=None, memory_frames=0, watchdog=None):
+    diagnostics = MemoryDiagnostics(memory_frames)
+    app.router.add_get("/admin/memory", functools.partial(
+        memory, clients=clients, admission=admission, diagnostics=diagnostics))
+    app.router.add_get("/admin/loop", functools.partial(loop, watchdog=watchdog))
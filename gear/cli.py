@@ -1,29 +1,302 @@
+import json
+import time
+import asyncio
+import inspect
+import functools
 import click
 import requests
-from .thor.client import thor
+from .thor.client import (
+    thor,
+    use_client,
+    reset_client,
+    ThorClient,
+)
+from .thor.batch import (
+    CallBatcher,
+    use_batcher,
+    reset_batcher,
+)
+from .ipc import ipc_listener
+from .admin import (
+    add_admin_routes,
+    in_flight,
+)
+from .thor.head import HeadWatcher
+from .thor.indexer import EventIndex
+from .thor.watcher import ReceiptWatcher
+from .thor.prefetch import Prefetcher
 from .thor.account import (
+    account as _no_accounts,
     solo,
     keystore as _keystore,
 )
-from .rpc import make_version
+from .thor.store import ChainStore
+from .thor.request import Upstream
+from .thor.recorder import (
+    Recorder,
+    Replay,
+)
+from .utils.cache import (
+    BytesCache,
+    ObjectCache,
+)
+from .utils.shared import SharedCache
+from .utils.limiter import AdaptiveLimiter
+from .utils.admission import (
+    AdmissionController,
+    Rejected,
+)
+from .utils import deadline
+from .utils.accesslog import access_log
+from .utils.watchdog import LoopWatchdog
+from .utils.thread import offloader
+from .rpc import (
+    make_version,
+    dispatch_block_batch,
+    STREAMING_METHODS,
+)
 from aiohttp import web
 from jsonrpcserver import async_dispatch
+from jsonrpcserver.response import ExceptionResponse
 
 
 res_headers = {
-    "Access-Control-Allow-Headers": "Origin, X-Requested-With, Content-Type, Accept",
+    "Access-Control-Allow-Headers": "Origin, X-Requested-With, Content-Type, Accept, " + deadline.DEADLINE_HEADER,
     "Access-Control-Allow-Origin": "*",
     "Connection": "keep-alive",
 }
 
 
-async def handle(request, logging=False, debug=False):
-    request = await request.text()
-    response = await async_dispatch(request, basic_logging=logging, debug=debug)
-    if response.wanted:
-        return web.json_response(response.deserialized(), headers=res_headers, status=response.http_status)
-    else:
+# EIP-1474 "Limit exceeded"
+LIMIT_EXCEEDED = -32005
+TIMED_OUT = -32000
+
+
+def parse(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def request_methods(obj):
+    items = obj if isinstance(obj, list) else [obj]
+    return [item.get("method") for item in items if isinstance(item, dict)]
+
+
+def error_body(obj, code, message):
+    def error(item):
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": code, "message": message},
+            "id": item.get("id") if isinstance(item, dict) else None,
+        }
+    return [error(item) for item in obj] if isinstance(obj, list) else error(obj)
+
+
+def error_response(obj, code, message):
+    return web.json_response(error_body(obj, code, message), headers=res_headers)
+
+
+async def stream(request, obj, debug=False):
+    '''
+    Serve a single request for one of STREAMING_METHODS by writing the result body as it
+    arrives. Returns None to fall back to regular dispatch, which reports invalid arguments.
+    '''
+    if not isinstance(obj, dict) or obj.get("method") not in STREAMING_METHODS or "id" not in obj:
+        return None
+    params = obj.get("params", [])
+    args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+    try:
+        chunks = STREAMING_METHODS[obj["method"]](*args, **kwargs).__aiter__()
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        chunks, first = None, b"null"
+    except (TypeError, ValueError):
+        return None
+    except asyncio.TimeoutError:
+        raise
+    except Exception as e:
+        # dispatching again would repeat the upstream requests that just failed
+        access_log.error("{} failed".format(obj["method"]), exc_info=True, method=obj["method"])
+        error = ExceptionResponse(e, id=obj["id"], debug=debug)
+        return json_body(request, str(error), error.http_status)
+
+    response = web.StreamResponse(headers=res_headers)
+    response.content_type = "application/json"
+    if request.app.get("compress_threshold", 0) > 0:
+        response.enable_compression()
+    await response.prepare(request)
+    request["streamed"] = response
+    await response.write(b'{"jsonrpc":"2.0","id":' + json.dumps(obj["id"]).encode("utf-8") + b',"result":')
+    try:
+        await response.write(first)
+        if chunks is not None:
+            async for chunk in chunks:
+                await response.write(chunk)
+        await response.write(b"}")
+        await response.write_eof()
+    except ConnectionResetError:
+        pass
+    finally:
+        # stop reading from Thor as soon as the client is gone
+        if chunks is not None:
+            await chunks.aclose()
+    return response
+
+
+async def dispatch(text, obj, logging=False, debug=False):
+    '''
+    The response body and HTTP status of a JSON-RPC request, or None if no response is wanted.
+    '''
+    batch = await dispatch_block_batch(obj, debug)
+    if batch is not None:
+        return json.dumps(batch), 200
+    # calls of one batch share a multi-clause inspection, where they see each other's writes
+    batch_token = None
+    if thor.batch_calls and isinstance(obj, list) and request_methods(obj).count("eth_call") > 1:
+        batch_token = use_batcher(CallBatcher())
+    try:
+        response = await async_dispatch(text, basic_logging=logging, debug=debug)
+    finally:
+        if batch_token is not None:
+            reset_batcher(batch_token)
+    return (str(response), response.http_status) if response.wanted else None
+
+
+async def respond(request, text, obj, logging=False, debug=False):
+    streamed = await stream(request, obj, debug)
+    if streamed is not None:
+        return streamed
+    result = await dispatch(text, obj, logging, debug)
+    if result is None:
         return web.Response(headers=res_headers, content_type="text/plain")
+    return json_body(request, *result)
+
+
+def json_body(request, body, status=200):
+    result = web.Response(text=body, content_type="application/json", headers=res_headers, status=status)
+    threshold = request.app.get("compress_threshold", 0)
+    if 0 < threshold <= len(body):
+        result.enable_compression()
+    return result
+
+
+async def admit(obj, respond, admission=None):
+    if admission is None or obj is None:
+        return await respond()
+    async with admission.slot(request_methods(obj)):
+        return await respond()
+
+
+async def serve(obj, respond, error, admission=None, deadlines=None, client=None, requested_timeout=None,
+                transport="http"):
+    '''
+    Run `respond` for a parsed request on `client`, under admission control and its deadline.
+    Shared by the HTTP and IPC transports, which supply `respond` and `error`.
+    '''
+    client_token = None if client is None else use_client(client)
+    methods = request_methods(obj)
+    timeout = None
+    if deadlines is not None and obj is not None:
+        timeout = deadlines.timeout(methods, requested_timeout)
+    token = deadline.start(timeout)
+    start = time.monotonic()
+    outcome = "ok"
+    in_flight[transport] += 1
+    try:
+        return await asyncio.wait_for(admit(obj, respond, admission), timeout)
+    except Rejected as e:
+        outcome = "rejected"
+        return error(obj, LIMIT_EXCEEDED, str(e))
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        return error(obj, TIMED_OUT, "request timed out")
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        fields = {"transport": transport}
+        if client is not None:
+            fields["network"] = client.endpoint
+        access_log.access(methods, time.monotonic() - start, outcome, **fields)
+        in_flight[transport] -= 1
+        deadline.reset(token)
+        if client_token is not None:
+            reset_client(client_token)
+
+
+async def handle(request, logging=False, debug=False, admission=None, deadlines=None, client=None):
+    text = await request.text()
+    recorder = request.app.get("recorder")
+    if recorder is not None:
+        recorder.record("rpc", path=request.path, body=text)
+    obj = parse(text)
+
+    def error(obj, code, message):
+        streamed = request.get("streamed")
+        if streamed is None:
+            return error_response(obj, code, message)
+        # the status line has been sent, so drop the connection to end the body unfinished
+        access_log.error("streamed response aborted", method=obj.get("method"), error=message)
+        if request.transport is not None:
+            request.transport.close()
+        return streamed
+    return await serve(
+        obj, lambda: respond(request, text, obj, logging, debug), error,
+        admission, deadlines, client, request.headers.get(deadline.DEADLINE_HEADER))
+
+
+async def handle_ipc(text, logging=False, debug=False, admission=None, deadlines=None, recorder=None):
+    if recorder is not None:
+        recorder.record("rpc", path="/", body=text)
+    obj = parse(text)
+
+    async def respond():
+        result = await dispatch(text, obj, logging, debug)
+        return None if result is None else result[0]
+
+    def error(obj, code, message):
+        return json.dumps(error_body(obj, code, message))
+    return await serve(obj, respond, error, admission, deadlines, transport="ipc")
+
+
+async def close_clients(clients):
+    for client in clients:
+        await client.close()
+
+
+async def close_recorder(recorder):
+    recorder.close()
+
+
+def check_endpoint(endpoint):
+    try:
+        response = requests.options(endpoint)
+        response.raise_for_status()
+    except requests.exceptions.ConnectionError:
+        print("Unable to connect to Thor-Restful server.")
+        return False
+    return True
+
+
+def genesis_id(endpoint):
+    response = requests.get(endpoint + "/blocks/0")
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def make_upstream(recorder=None, replay=None, concurrency=0):
+    limiter = AdaptiveLimiter(concurrency) if concurrency > 0 else None
+    return Upstream(recorder=recorder, replay=replay, limiter=limiter)
+
+
+def background(coro_func, *args):
+    async def ctx(app):
+        task = asyncio.ensure_future(coro_func(*args))
+        yield
+        task.cancel()
+    return ctx
 
 
 @click.command()
@@ -58,27 +331,303 @@ async def handle(request, logging=False, debug=False):
     default=False,
     type=bool,
 )
-def run_server(host, port, endpoint, keystore, passcode, log, debug):
-    try:
-        response = requests.options(endpoint)
-        response.raise_for_status()
-    except requests.exceptions.ConnectionError:
-        print("Unable to connect to Thor-Restful server.")
-        return
+@click.option(
+    "--store",
+    default="",
+)
+@click.option(
+    "--store-finality",
+    default=12,
+    type=int,
+)
+@click.option(
+    "--index-db",
+    default="",
+)
+@click.option(
+    "--index-address",
+    multiple=True,
+)
+@click.option(
+    "--index-from",
+    default=None,
+    type=int,
+)
+@click.option(
+    "--index-finality",
+    default=12,
+    type=int,
+)
+@click.option(
+    "--max-concurrency",
+    default=0,
+    type=int,
+)
+@click.option(
+    "--admission-config",
+    default="",
+)
+@click.option(
+    "--request-timeout",
+    default=0,
+    type=float,
+)
+@click.option(
+    "--method-timeout",
+    multiple=True,
+)
+@click.option(
+    "--compress-threshold",
+    default=1024,
+    type=int,
+)
+@click.option(
+    "--offload-threshold",
+    default=1000,
+    type=int,
+)
+@click.option(
+    "--network",
+    multiple=True,
+)
+@click.option(
+    "--record",
+    default="",
+)
+@click.option(
+    "--replay",
+    default="",
+)
+@click.option(
+    "--replay-speed",
+    default=0,
+    type=float,
+)
+@click.option(
+    "--watch-receipts",
+    default=False,
+    type=bool,
+)
+@click.option(
+    "--storage-range-cache",
+    default=256,
+    type=int,
+)
+@click.option(
+    "--batch-calls",
+    default=False,
+    type=bool,
+)
+@click.option(
+    "--call-batch-window",
+    default=0,
+    type=float,
+)
+@click.option(
+    "--upstream-concurrency",
+    default=0,
+    type=int,
+)
+@click.option(
+    "--object-cache-size",
+    default=0,
+    type=int,
+)
+@click.option(
+    "--object-cache-compress",
+    default=False,
+    type=bool,
+)
+@click.option(
+    "--shared-cache",
+    "shared_cache_path",
+    default="",
+)
+@click.option(
+    "--shared-cache-size",
+    default=256 * 1024 * 1024,
+    type=int,
+)
+@click.option(
+    "--ipc-path",
+    default="",
+)
+@click.option(
+    "--http-path",
+    default="",
+)
+@click.option(
+    "--access-log",
+    "access_log_path",
+    default="",
+)
+@click.option(
+    "--access-log-sample",
+    multiple=True,
+)
+@click.option(
+    "--access-log-slow",
+    default=0,
+    type=float,
+)
+@click.option(
+    "--admin",
+    default=False,
+    type=bool,
+)
+@click.option(
+    "--trace-memory",
+    default=0,
+    type=int,
+)
+@click.option(
+    "--loop-stall-threshold",
+    default=0,
+    type=float,
+)
+@click.option(
+    "--prefetch-blocks",
+    default=0,
+    type=int,
+)
+@click.option(
+    "--trace-cache-size",
+    default=0,
+    type=int,
+)
+@click.option(
+    "--trace-cache-dir",
+    default="",
+)
+def run_server(host, port, endpoint, keystore, passcode, log, debug, store, store_finality,
+               index_db, index_address, index_from, index_finality, max_concurrency, admission_config,
+               request_timeout, method_timeout, compress_threshold, offload_threshold,
+               storage_range_cache, trace_cache_size, trace_cache_dir, network, record, replay, replay_speed,
+               watch_receipts, batch_calls, call_batch_window, upstream_concurrency, object_cache_size,
+               object_cache_compress, ipc_path, http_path, access_log_path, access_log_sample,
+               access_log_slow, admin, trace_memory, loop_stall_threshold, prefetch_blocks,
+               shared_cache_path, shared_cache_size):
+    # name=url[,keystore], the keystore being unlocked with --passcode
+    networks = {}
+    for x in network:
+        name, spec = x.split("=", 1)
+        url, _, network_keystore = spec.partition(",")
+        networks[name] = (url, network_keystore)
+    for url in [endpoint] + [url for url, _ in networks.values()]:
+        if replay == "" and not check_endpoint(url):
+            return
+    recorder = None if record == "" else Recorder(record)
+    replayer = None if replay == "" else Replay(replay, replay_speed)
 
     print(make_version())
     print("Listening on %s:%s" % (host, port))
 
-    thor.set_endpoint(endpoint)
     if keystore == "":
-        thor.set_accounts(solo())
+        accounts = solo()
     else:
-        thor.set_accounts(_keystore(keystore, passcode))
+        accounts = _keystore(keystore, passcode)
+    thor.set_endpoint(endpoint, make_upstream(recorder, replayer, upstream_concurrency))
+    thor.set_accounts(accounts)
+    # a replayed session has no endpoint to ask, so what it stores is not tied to a chain
+    thor.set_genesis(None if replay != "" else genesis_id(endpoint))
+    if store != "":
+        thor.set_store(ChainStore(store, store_finality, thor.genesis))
+    thor.set_storage_range_cache(storage_range_cache)
+    thor.set_call_batching(call_batch_window / 1000, batch_calls)
+    offloader.configure(offload_threshold)
+    if access_log_path != "":
+        access_log.configure(
+            access_log_path, {m: float(r) for m, r in (x.split("=", 1) for x in access_log_sample)},
+            access_log_slow / 1000)
+    if trace_cache_size > 0:
+        thor.set_trace_cache(BytesCache(trace_cache_size, trace_cache_dir or None), store_finality)
+    # one memory budget shared by all networks
+    object_cache = None
+    if object_cache_size > 0:
+        object_cache = ObjectCache(object_cache_size, object_cache_compress)
+        thor.set_object_cache(object_cache, store_finality)
+    # finalized objects also shared with the other gear processes of this host
+    shared_cache = None
+    if shared_cache_path != "":
+        shared_cache = ObjectCache(
+            shared_cache_size, object_cache_compress, SharedCache(shared_cache_path, shared_cache_size))
+        thor.set_shared_cache(shared_cache, store_finality)
+
+    clients = {}
+    for name, (url, network_keystore) in networks.items():
+        client = clients[name] = ThorClient()
+        client.set_endpoint(url, make_upstream(recorder, replayer, upstream_concurrency))
+        client.set_genesis(None if replay != "" else genesis_id(url))
+        # the --endpoint keys are not meant for other networks
+        client.set_accounts(
+            _no_accounts() if network_keystore == "" else _keystore(network_keystore, passcode))
+        client.set_storage_range_cache(storage_range_cache)
+        client.set_call_batching(call_batch_window / 1000, batch_calls)
+        if object_cache is not None:
+            client.set_object_cache(object_cache, store_finality)
+        if shared_cache is not None:
+            client.set_shared_cache(shared_cache, store_finality)
+
+    admission = None
+    if max_concurrency > 0:
+        config = {}
+        if admission_config != "":
+            with open(admission_config) as f:
+                config = json.load(f)
+        admission = AdmissionController(max_concurrency, config.get("classes"), config.get("methods"))
+
+    deadlines = deadline.Deadlines(
+        request_timeout or None,
+        {m: float(t) for m, t in (x.split("=", 1) for x in method_timeout)})
 
     app = web.Application()
-    app.router.add_post("/", lambda r: handle(r, log, debug))
-    app.router.add_options("/", lambda r: web.Response(headers=res_headers))
-    web.run_app(app, host=host, port=port)
+    app["compress_threshold"] = compress_threshold
+    app["recorder"] = recorder
+    head = HeadWatcher(thor)
+    if index_db != "":
+        try:
+            event_index = EventIndex(
+                index_db, index_address, index_from, index_finality, genesis=thor.genesis)
+        except ValueError as e:
+            print(e)
+            return
+        thor.set_event_index(event_index)
+        head.subscribe(event_index.on_head)
+        app.cleanup_ctx.append(background(event_index.run, thor))
+    prefetcher = None
+    if prefetch_blocks > 0:
+        prefetcher = Prefetcher(thor, prefetch_blocks)
+        thor.set_prefetcher(prefetcher)
+        head.subscribe(prefetcher.on_head)
+    if watch_receipts:
+        # subscribed after the prefetcher, so it reads the blocks just prefetched
+        receipt_watcher = ReceiptWatcher(thor, prefetcher=prefetcher)
+        thor.set_receipt_watcher(receipt_watcher)
+        head.subscribe(receipt_watcher.on_head)
+    if head.subscribers:
+        app.cleanup_ctx.append(background(head.run))
+    for name, client in [("", None)] + list(clients.items()):
+        app.router.add_post("/" + name, functools.partial(
+            handle, logging=log, debug=debug, admission=admission, deadlines=deadlines, client=client))
+        app.router.add_options("/" + name, lambda r: web.Response(headers=res_headers))
+    if ipc_path != "":
+        app.cleanup_ctx.append(ipc_listener(ipc_path, functools.partial(
+            handle_ipc, logging=log, debug=debug, admission=admission, deadlines=deadlines,
+            recorder=recorder)))
+    watchdog = None
+    if loop_stall_threshold > 0:
+        watchdog = LoopWatchdog(loop_stall_threshold / 1000)
+        app.cleanup_ctx.append(background(watchdog.run))
+    if admin:
+        add_admin_routes(app, dict(clients, **{"": thor.default}), admission, trace_memory, watchdog)
+    app.on_cleanup.append(lambda app: close_clients([thor.default] + list(clients.values())))
+    if recorder is not None:
+        app.on_cleanup.append(lambda app: close_recorder(recorder))
+    kwargs = {}
+    if "handler_cancellation" in inspect.signature(web.run_app).parameters:
+        # aiohttp >= 3.9 no longer cancels handlers of disconnected clients by default
+        kwargs["handler_cancellation"] = True
+    web.run_app(app, host=host, port=port, path=http_path or None, **kwargs)
 
 
 if __name__ == '__main__':
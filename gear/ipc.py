@@ -0,0 +1,109 @@
+import os
+import json
+import codecs
+import asyncio
+from .utils.accesslog import access_log
+
+
+# upper bound of a single unanswered request held in a connection buffer
+MAX_MESSAGE = 16 * 1024 * 1024
+
+
+def incomplete(error):
+    '''
+    Whether a decoding error only means the value has not been fully received: it stopped in
+    an unterminated string, or at a last token that more text may still complete.
+    '''
+    if error.msg.startswith("Unterminated string"):
+        return True
+    rest = error.doc[error.pos:]
+    return not any(c.isspace() or c in ",:]}" for c in rest)
+
+
+def split_messages(buffer):
+    '''
+    Split complete JSON values off the front of `buffer`. Requests may be newline-delimited
+    or simply concatenated, as geth IPC clients send them. Malformed text up to the next
+    newline is split off too, to be answered with a parse error. Returns (messages, rest).
+    '''
+    decoder = json.JSONDecoder()
+    messages = []
+    index = 0
+    while True:
+        while index < len(buffer) and buffer[index] in " \t\r\n":
+            index += 1
+        if index >= len(buffer):
+            return messages, ""
+        try:
+            _, end = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError as e:
+            if incomplete(e):
+                return messages, buffer[index:]
+            end = buffer.find("\n", e.pos)
+            end = len(buffer) if end < 0 else end
+        messages.append(buffer[index:end])
+        index = end
+
+
+async def serve_connection(reader, writer, handle_message):
+    tasks = set()
+
+    async def answer(text):
+        try:
+            body = await handle_message(text)
+        except Exception:
+            access_log.error("IPC request failed", exc_info=True)
+            return
+        if body is not None:
+            writer.write(body.encode("utf-8") + b"\n")
+
+    buffer = ""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        while True:
+            data = await reader.read(64 * 1024)
+            if not data:
+                break
+            buffer += decoder.decode(data)
+            messages, buffer = split_messages(buffer)
+            if len(buffer) > MAX_MESSAGE:
+                break
+            for text in messages:
+                # requests on one connection are served concurrently and answered as they finish
+                task = asyncio.ensure_future(answer(text))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+            await writer.drain()
+    except (ConnectionResetError, UnicodeDecodeError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+
+async def start_ipc_server(path, handle_message):
+    '''
+    Serve JSON-RPC over a Unix domain socket at `path`, geth IPC style: a stream of JSON
+    requests answered with newline-terminated JSON responses. `handle_message` maps request
+    text to response text, or None when no response is wanted.
+    '''
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: serve_connection(reader, writer, handle_message), path)
+    os.chmod(path, 0o600)
+    return server
+
+
+def ipc_listener(path, handle_message):
+    async def ctx(app):
+        server = await start_ipc_server(path, handle_message)
+        yield
+        server.close()
+        await server.wait_closed()
+        if os.path.exists(path):
+            os.remove(path)
+    return ctx
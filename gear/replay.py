@@ -0,0 +1,72 @@
+import json
+import time
+import asyncio
+import aiohttp
+import click
+
+
+def load_requests(path):
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    return [e for e in entries if e["kind"] == "rpc"]
+
+
+async def send(session, url, entry, latencies, errors):
+    start = time.monotonic()
+    try:
+        async with session.post(url + entry["path"], data=entry["body"],
+                                headers={"Content-Type": "application/json"}) as response:
+            await response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+    except aiohttp.ClientError as e:
+        errors.append(e)
+    latencies.append(time.monotonic() - start)
+
+
+async def replay(requests, url, speed):
+    latencies, errors, tasks = [], [], []
+    async with aiohttp.ClientSession() as session:
+        start = time.monotonic()
+        first = requests[0]["time"] if requests else 0
+        for entry in requests:
+            if speed > 0:
+                delay = (entry["time"] - first) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(session, url, entry, latencies, errors)))
+        await asyncio.gather(*tasks)
+        return latencies, errors, time.monotonic() - start
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+@click.command()
+@click.argument("recording")
+@click.option(
+    "--target",
+    default="http://127.0.0.1:8545",
+)
+@click.option(
+    "--speed",
+    default=1.0,
+    type=float,
+)
+def run_replay(recording, target, speed):
+    '''
+    Re-send the JSON-RPC requests of a `web3-gear --record` file to `target`, keeping their
+    original spacing divided by `speed` (0 sends them all at once).
+    '''
+    requests = load_requests(recording)
+    latencies, errors, elapsed = asyncio.get_event_loop().run_until_complete(
+        replay(requests, target.rstrip("/"), speed))
+    latencies.sort()
+    print("requests: %d, errors: %d, elapsed: %.3fs" % (len(latencies), len(errors), elapsed))
+    print("latency p50: %.1fms, p90: %.1fms, p99: %.1fms, max: %.1fms" % tuple(
+        percentile(latencies, p) * 1000 for p in (0.5, 0.9, 0.99, 1)))
+
+
+if __name__ == '__main__':
+    run_replay()
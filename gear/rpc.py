@@ -1,11 +1,16 @@
+import asyncio
 import itertools
 import functools
 import logging
 import sys
 import json
-import traceback
 from .thor.client import thor
+from .utils.accesslog import access_log
 from .utils.compat import noop
+from .utils.thread import (
+    offloader,
+    ordered,
+)
 from .utils.types import (
     encode_number,
     force_obj_to_text,
@@ -13,6 +18,19 @@ from .utils.types import (
     normalize_number
 )
 from jsonrpcserver import method
+from jsonrpcserver.response import ExceptionResponse
+
+
+def result_size(result):
+    '''
+    Rough item count of a result: list length, or the lengths of the lists in a dict
+    (block transactions, receipt logs).
+    '''
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(len(v) for v in result.values() if isinstance(v, list))
+    return 0
 
 
 def async_serialize(func):
@@ -22,9 +40,9 @@ def async_serialize(func):
             result = await func(*args, **kw)
             if isinstance(result, str):
                 return result
-            return force_obj_to_text(result, True)
+            return await offloader.run(result_size(result), force_obj_to_text, result, True)
         except Exception as e:
-            traceback.print_exc()
+            access_log.error("{} failed".format(func.__name__), exc_info=True, method=func.__name__)
             raise e
     return wrapper
 
@@ -57,29 +75,65 @@ def input_log_filter_formatter(filter_params):
     }
 
 
-def topics_formatter(eth_topics, address=None):
-    if (not eth_topics) and (not address):
-        return []
-
-    if (not eth_topics) and address:
-        return [{"address": address}]
-    
-    if eth_topics:
-        matrix = [x if isinstance(x, list) else [x] for x in eth_topics]
-        temp_list = [
-            {
-                "topic{}".format(index): topic
-                for index, topic in enumerate(e)
-            }
-            for e in itertools.product(*matrix)
-        ]
-
-        if not address:
-            return temp_list
-        else:
-            for item in temp_list:
-                item["address"] = address
-            return temp_list
+# upper bound of criteria sent to Thor in one query, remaining topic positions are matched locally
+MAX_CRITERIA = 64
+
+
+def topics_matrix(eth_topics):
+    return [
+        None if x is None else [t.lower() for t in (x if isinstance(x, list) else [x])]
+        for x in eth_topics or []
+    ]
+
+
+def topics_positions(matrix, max_criteria=MAX_CRITERIA):
+    '''
+    Pick the topic positions sent to Thor, fewest alternatives first, so that their
+    cartesian product stays within `max_criteria`.
+    '''
+    candidates = sorted(
+        (index for index, e in enumerate(matrix) if e),
+        key=lambda index: len(matrix[index]))
+    positions = []
+    size = 1
+    for index in candidates:
+        if positions and size * len(matrix[index]) > max_criteria:
+            break
+        positions.append(index)
+        size *= len(matrix[index])
+    return sorted(positions)
+
+
+def topics_formatter(eth_topics, address=None, max_criteria=MAX_CRITERIA):
+    matrix = topics_matrix(eth_topics)
+    positions = topics_positions(matrix, max_criteria)
+    if not positions:
+        return [{"address": address}] if address else []
+
+    temp_list = [
+        {
+            "topic{}".format(index): topic
+            for index, topic in zip(positions, e)
+        }
+        for e in itertools.product(*[matrix[index] for index in positions])
+    ]
+    if address:
+        for item in temp_list:
+            item["address"] = address
+    return temp_list
+
+
+def topics_residual(eth_topics, max_criteria=MAX_CRITERIA):
+    '''
+    The topic positions left out by `topics_formatter`, to be matched against the returned logs.
+    '''
+    matrix = topics_matrix(eth_topics)
+    positions = topics_positions(matrix, max_criteria)
+    return {
+        index: set(e)
+        for index, e in enumerate(matrix)
+        if e and index not in positions
+    }
 
 #
 #
@@ -90,6 +144,7 @@ async def rpc_modules():
         "eth": "1.0",
         "net": "1.0",
         "web3": "1.0",
+        "gear": "1.0",
     }
 
 
@@ -102,6 +157,10 @@ async def debug_traceTransaction(tx_hash, params):
     return await thor.trace_transaction(tx_hash)
 
 
+def debug_traceTransaction_stream(tx_hash, params):
+    return thor.trace_transaction_stream(tx_hash)
+
+
 @method
 @async_serialize
 async def debug_storageRangeAt(blk_hash, tx_index, contract_addr, key_start, max_result):
@@ -260,11 +319,101 @@ async def eth_getBlockByNumber(block_number, full_tx=False):
 async def get_block(block_identifier, full_tx):
     blk = await thor.get_block(normalize_block_identifier(block_identifier))
     if blk and full_tx:
-        blk["transactions"] = [eth_getTransactionByHash(
-            tx) for tx in blk["transactions"]]
+        blk = dict(blk, transactions=await asyncio.gather(*[
+            eth_getTransactionByHash(tx) for tx in blk["transactions"]]))
     return blk
 
 
+#
+# gear
+#
+BLOCK_RANGE_CONCURRENCY = 8
+MAX_BLOCK_RANGE = 10000
+
+
+def iter_block_range(from_block, to_block, full_tx=False):
+    frm, to = normalize_number(from_block), normalize_number(to_block)
+    if to < frm or to - frm >= MAX_BLOCK_RANGE:
+        raise ValueError("Block range must hold 1 to {} blocks.".format(MAX_BLOCK_RANGE))
+    return ordered(
+        (get_block(hex(number), full_tx) for number in range(frm, to + 1)), BLOCK_RANGE_CONCURRENCY)
+
+
+@method
+@async_serialize
+async def gear_getBlockRange(from_block, to_block, full_tx=False):
+    return [blk async for blk in iter_block_range(from_block, to_block, full_tx)]
+
+
+async def gear_getBlockRange_stream(from_block, to_block, full_tx=False):
+    blocks = iter_block_range(from_block, to_block, full_tx)
+    separator = b"["
+    async for blk in blocks:
+        yield separator + json.dumps(force_obj_to_text(blk, True)).encode("utf-8")
+        separator = b","
+    yield b"]"
+
+
+def consecutive_block_batch(obj):
+    '''
+    The (from, to, full_tx) range requested by a batch of `eth_getBlockByNumber` calls for
+    consecutive block numbers, or None for any other request.
+    '''
+    if not isinstance(obj, list) or len(obj) < 2:
+        return None
+    numbers, flags = [], set()
+    for item in obj:
+        if not isinstance(item, dict) or item.get("method") != "eth_getBlockByNumber" or "id" not in item:
+            return None
+        params = item.get("params")
+        if not isinstance(params, list) or not 1 <= len(params) <= 2:
+            return None
+        try:
+            numbers.append(normalize_number(params[0]))
+        except Exception:
+            return None
+        flags.add(bool(params[1]) if len(params) > 1 else False)
+    if len(flags) != 1 or numbers != list(range(numbers[0], numbers[0] + len(numbers))):
+        return None
+    return numbers[0], numbers[-1], flags.pop()
+
+
+async def _block_outcome(number, full_tx):
+    try:
+        return await get_block(hex(number), full_tx), None
+    except Exception as e:
+        access_log.error("eth_getBlockByNumber failed", exc_info=True, method="eth_getBlockByNumber")
+        return None, e
+
+
+async def dispatch_block_batch(obj, debug=False):
+    '''
+    Answer a batch of consecutive `eth_getBlockByNumber` calls with bounded concurrency,
+    each failed call with its own error. Returns None for other requests.
+    '''
+    block_range = consecutive_block_batch(obj)
+    if block_range is None:
+        return None
+    frm, to, full_tx = block_range
+    if to - frm >= MAX_BLOCK_RANGE:
+        return None
+    outcomes = [outcome async for outcome in ordered(
+        (_block_outcome(number, full_tx) for number in range(frm, to + 1)), BLOCK_RANGE_CONCURRENCY)]
+    return [
+        {"jsonrpc": "2.0", "result": force_obj_to_text(blk, True), "id": item["id"]} if error is None
+        else ExceptionResponse(error, id=item["id"], debug=debug).deserialized()
+        for item, (blk, error) in zip(obj, outcomes)
+    ]
+
+
+@method
+@async_serialize
+async def gear_multiCall(transactions, block_identifier="best"):
+    return await thor.multi_call(
+        [input_transaction_formatter(tx) for tx in transactions],
+        normalize_block_identifier(block_identifier))
+
+
 @method
 async def eth_newBlockFilter():
     return await thor.new_block_filter()
@@ -285,4 +434,17 @@ async def eth_getFilterChanges(filter_id):
 @method
 @async_serialize
 async def eth_getLogs(filter_obj):
-    return await thor.get_logs(filter_obj.get("address", None), input_log_filter_formatter(filter_obj))
+    return await thor.get_logs(
+        filter_obj.get("address", None),
+        input_log_filter_formatter(filter_obj),
+        topics_residual(filter_obj.get("topics", [])))
+
+
+#
+# streaming
+#
+# results written straight to the client by the handler, without decoding and re-encoding
+STREAMING_METHODS = {
+    "debug_traceTransaction": debug_traceTransaction_stream,
+    "gear_getBlockRange": gear_getBlockRange_stream,
+}
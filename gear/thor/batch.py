@@ -0,0 +1,152 @@
+import re
+import asyncio
+import contextvars
+from gear.utils.types import encode_number
+from .request import (
+    post,
+    OVERLOAD_STATUS,
+    UpstreamError,
+)
+
+
+# upper bound of clauses sent to Thor in one inspection
+MAX_CLAUSES = 100
+
+
+def is_batchable(transaction):
+    '''
+    Calls transferring value change balances seen by later clauses, so they are sent alone.
+    '''
+    return not transaction.get("value")
+
+
+HEX_DATA = re.compile(r"^0x([0-9a-fA-F]{2})*$")
+ADDRESS = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+
+def call_clause(transaction):
+    '''
+    The inspection clause of a call. Thor rejects a whole inspection for one bad clause, so
+    the fields it would reject are checked here, where only the call at fault fails.
+    '''
+    data = transaction["data"]
+    if not isinstance(data, str) or HEX_DATA.match(data) is None:
+        raise ValueError("invalid call data: {!r}".format(data))
+    to = transaction.get("to", None)
+    if to is not None and (not isinstance(to, str) or ADDRESS.match(to) is None):
+        raise ValueError("invalid call address: {!r}".format(to))
+    return {
+        "to": to,
+        "value": encode_number(transaction.get("value", 0)).decode("utf-8"),
+        "data": data,
+    }
+
+
+async def inspect_clauses(client, clauses, revision, caller=None):
+    '''
+    Simulate calls from one caller with multi-clause `POST /accounts/*` requests and return
+    the output data of each. Thor stops at the first reverted clause, so the clauses after it
+    are sent again. A clause reverted behind others is retried at the front of the next
+    request, where it has the whole gas allowance as it would when called alone.
+    '''
+    results = []
+    params = {"revision": revision}
+    while len(results) < len(clauses):
+        data = {
+            "clauses": clauses[len(results):len(results) + MAX_CLAUSES],
+            "caller": caller,
+        }
+        outputs = await client.accounts("*").make_request(post, data=data, params=params)
+        if not outputs:
+            raise Exception("Empty inspection result.")
+        for index, output in enumerate(outputs):
+            if output["reverted"] and index > 0:
+                break
+            results.append(output["data"])
+            if output["reverted"]:
+                break
+    return results
+
+
+def rejected(error):
+    '''
+    Whether Thor refused the request itself, rather than being overloaded or unreachable.
+    '''
+    return isinstance(error, UpstreamError) and 400 <= error.status < 500 and \
+        error.status not in OVERLOAD_STATUS
+
+
+class CallBatcher(object):
+    '''
+    Collects calls made within `window` seconds, or within the current loop iteration when
+    `window` is 0, and sends those for the same client, revision and caller as one inspection.
+    '''
+
+    def __init__(self, window=0):
+        super(CallBatcher, self).__init__()
+        self.window = window
+        self.pending = {}
+        self.handle = None
+
+    def call(self, client, transaction, revision):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        try:
+            clause = call_clause(transaction)
+        except (KeyError, TypeError, ValueError) as e:
+            future.set_exception(e)
+            return future
+        key = (client, revision, transaction.get("from", None))
+        self.pending.setdefault(key, []).append((clause, future))
+        if self.handle is None:
+            # the shared request must not inherit the deadline of whichever call came first
+            context = contextvars.Context()
+            if self.window > 0:
+                self.handle = loop.call_later(self.window, self.flush, context=context)
+            else:
+                self.handle = loop.call_soon(self.flush, context=context)
+        return future
+
+    def flush(self):
+        pending, self.pending, self.handle = self.pending, {}, None
+        for (client, revision, caller), calls in pending.items():
+            asyncio.ensure_future(self._send(client, revision, caller, calls))
+
+    async def _send(self, client, revision, caller, calls):
+        try:
+            results = await inspect_clauses(client, [clause for clause, _ in calls], revision, caller)
+        except Exception as e:
+            if len(calls) > 1 and rejected(e):
+                # a clause Thor rejects fails the whole inspection, send each alone to find it
+                await asyncio.gather(*[
+                    self._send(client, revision, caller, [call]) for call in calls
+                ])
+            else:
+                self._fail(calls, e)
+            return
+        for (_, future), result in zip(calls, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _fail(self, calls, error):
+        for _, future in calls:
+            if not future.done():
+                future.set_exception(error)
+
+
+_batcher = contextvars.ContextVar("call_batcher", default=None)
+
+
+def use_batcher(batcher):
+    '''
+    Send the calls of the rest of the current request through `batcher`.
+    '''
+    return _batcher.set(batcher)
+
+
+def reset_batcher(token):
+    _batcher.reset(token)
+
+
+def current_batcher():
+    return _batcher.get()
@@ -1,6 +1,11 @@
+import re
+import json
 import rlp
 import uuid
-from gear.utils.singleton import Singleton
+import asyncio
+import contextvars
+from lru import LRU
+from gear.utils.thread import offloader
 from gear.utils.types import (
     encode_number,
     encode_hex,
@@ -15,6 +20,12 @@ from gear.utils.compat import (
     ThorTransaction,
     intrinsic_gas,
 )
+from .store import block_key
+from .batch import (
+    CallBatcher,
+    current_batcher,
+    is_batchable,
+)
 from .request import (
     Restful,
     get,
@@ -22,43 +33,215 @@ from .request import (
 )
 
 
+TX_HASH = re.compile(r"^0x[0-9a-fA-F]{64}$")
+
+
 def _attribute(obj, key): return None if obj is None else obj[key]
 
 
-class ThorClient(object, metaclass=Singleton):
+def match_topics(log_topics, topics):
+    return all(
+        index < len(log_topics) and log_topics[index].lower() in alternatives
+        for index, alternatives in topics.items()
+    )
+
+
+class ThorClient(object):
     def __init__(self):
         self.filter = {}
+        self.store = None
+        self.event_index = None
+        self.trace_cache = None
+        self.receipt_watcher = None
+        self.storage_ranges = LRU(256)
+        self.call_batcher = None
+        self.batch_calls = False
+        self.object_cache = None
+        self.shared_cache = None
+        self.prefetcher = None
+        self.genesis = None
+        self.best_number = None
 
-    def set_endpoint(self, endpoint):
-        restful = Restful(endpoint)
+    def set_endpoint(self, endpoint, upstream=None):
+        restful = Restful(endpoint, upstream)
+        self.endpoint = endpoint
+        self.upstream = restful._upstream
         self.transactions = restful.transactions
         self.blocks = restful.blocks
         self.accounts = restful.accounts
         self.logs = restful.logs
         self.debug = restful.debug
 
+    async def close(self):
+        await self.upstream.close()
+
     def set_accounts(self, account_manager):
         self.account_manager = account_manager
 
+    def set_genesis(self, genesis):
+        '''
+        The genesis block ID of the endpoint's chain, which scopes what caches outlive the process.
+        '''
+        self.genesis = None if genesis is None else genesis.lower()
+
+    def _chain(self):
+        return self.genesis or self.endpoint
+
+    def set_store(self, store):
+        self.store = store
+
+    def set_object_cache(self, object_cache, finality=12):
+        '''
+        Keep finalized blocks, transactions and receipts in `object_cache`, which may be shared
+        with other clients, ahead of the store.
+        '''
+        self.object_cache = object_cache
+        self.cache_finality = finality
+
+    def set_shared_cache(self, shared_cache, finality=12):
+        '''
+        Keep finalized blocks, transactions and receipts in `shared_cache` as well, an object
+        cache backed by a file that the other gear processes of the host also use.
+        '''
+        self.shared_cache = shared_cache
+        self.cache_finality = finality
+
+    def _caches(self):
+        return [c for c in (self.object_cache, self.shared_cache) if c is not None]
+
+    def _cache_get(self, key):
+        '''
+        Look `key` up in the caches in order, filling the ones before the hit.
+        '''
+        caches = self._caches()
+        for i, cache in enumerate(caches):
+            obj = cache.get(key)
+            if obj is not None:
+                for upper in caches[:i]:
+                    upper.put(key, obj)
+                return obj
+        return None
+
+    def _cache_put(self, key, obj):
+        for cache in self._caches():
+            cache.put(key, obj)
+
+    def _cached_block(self, block_identifier):
+        key = block_key(block_identifier)
+        if not self._caches() or key is None:
+            return None
+        column, value = key
+        # ids are unique across chains, numbers are not
+        if column == "number":
+            value = self._cache_get("block-id {} {}".format(self._chain(), value))
+        return None if value is None else self._cache_get("block {}".format(value))
+
+    def _cache_block(self, number, block_id, blk):
+        self._cache_put("block {}".format(block_id.lower()), blk)
+        self._cache_put("block-id {} {}".format(self._chain(), number), block_id.lower())
+
+    async def _keep(self, block_number, kind, key, obj):
+        '''
+        Cache and persist a converted object once its block is final.
+        '''
+        if self._caches() and await self.is_finalized(block_number, self.cache_finality):
+            if kind == "block":
+                self._cache_block(block_number, key, obj)
+            else:
+                self._cache_put("{} {}".format(kind, key.lower()), obj)
+        if self.store is not None and await self.is_finalized(block_number, self.store.finality):
+            if kind == "block":
+                await self.store.worker.run(self.store.put_block, block_number, key, obj)
+            elif kind == "tx":
+                await self.store.worker.run(self.store.put_transaction, key, obj)
+            else:
+                await self.store.worker.run(self.store.put_receipt, key, obj)
+
+    def set_event_index(self, event_index):
+        self.event_index = event_index
+
+    def set_receipt_watcher(self, receipt_watcher):
+        self.receipt_watcher = receipt_watcher
+
+    def set_prefetcher(self, prefetcher):
+        self.prefetcher = prefetcher
+
+    def set_storage_range_cache(self, size):
+        self.storage_ranges = LRU(size) if size > 0 else None
+
+    def set_call_batching(self, window, batch_calls=False):
+        '''
+        Gather concurrent calls for `window` seconds into multi-clause inspections, `0` disables it.
+        With `batch_calls`, the calls of one JSON-RPC batch share an inspection too.
+        '''
+        self.call_batcher = CallBatcher(window) if window > 0 else None
+        self.batch_calls = batch_calls
+
+    def set_trace_cache(self, trace_cache, finality=12):
+        self.trace_cache = trace_cache
+        self.trace_finality = finality
+
+    def _observe_best(self, number):
+        if number is not None and (self.best_number is None or number > self.best_number):
+            self.best_number = number
+
+    async def is_finalized(self, block_number, finality):
+        '''
+        The best block only moves forward, so judging by the last observed best is conservative.
+        '''
+        if self.best_number is None:
+            await self.get_block_number()
+        return self.best_number is not None and block_number <= self.best_number - finality
+
     async def trace_transaction(self, tx_hash):
+        body = b"".join([chunk async for chunk in self.trace_transaction_stream(tx_hash)])
+        return json.loads(body)
+
+    async def trace_transaction_stream(self, tx_hash):
+        '''
+        Yield the raw tracer result. Traces of finalized transactions are cached by tx hash.
+        '''
+        cacheable = self.trace_cache is not None and TX_HASH.match(tx_hash) is not None
+        key = tx_hash.lower()
+        if cacheable:
+            cached = self.trace_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
         tx = await self.transactions(tx_hash).make_request(get)
         if tx is None:
-            return None
+            yield b"null"
+            return
         data = {
             "name": "",
             "target": "{}/{}/0".format(tx["meta"]["blockID"], tx_hash)
         }
-        return await self.debug.tracers.make_request(post, data=data)
+        cacheable = cacheable and await self.is_finalized(tx["meta"]["blockNumber"], self.trace_finality)
+        chunks, size = [], 0
+        async for chunk in self.debug.tracers.stream_request(post, data=data):
+            if cacheable:
+                size += len(chunk)
+                if size <= self.trace_cache.max_entry:
+                    chunks.append(chunk)
+                else:
+                    cacheable, chunks = False, []
+            yield chunk
+        if cacheable:
+            self.trace_cache.put(key, b"".join(chunks))
 
     async def get_storage_at(self, address, position, block_identifier):
         params = {
             "revision": block_identifier
         }
-        storage = await self.accounts(address).storage(
-            position).make_request(get, params=params)
-        return _attribute(storage, "value")
+        return await self.accounts(address).storage(
+            position).make_field_request(get, "value", params=params)
 
     async def storage_range_at(self, blk_hash, tx_index, contract_addr, key_start, max_result):
+        # the state at a given block ID never changes, so those pages can be cached
+        cacheable = self.storage_ranges is not None and isinstance(blk_hash, str) and len(blk_hash) == 66
+        key = (blk_hash.lower(), tx_index, contract_addr.lower(), key_start, max_result) if cacheable else None
+        if cacheable and key in self.storage_ranges:
+            return self.storage_ranges[key]
         data = {
             "Address": contract_addr,
             "KeyStart": key_start,
@@ -70,6 +253,8 @@ class ThorClient(object, metaclass=Singleton):
             return None
         result["storage"] = thor_storage_convert_to_eth_storage(
             result["storage"])
+        if cacheable:
+            self.storage_ranges[key] = result
         return result
 
     def get_accounts(self):
@@ -77,7 +262,9 @@ class ThorClient(object, metaclass=Singleton):
 
     async def get_block_number(self):
         blk = await self.blocks("best").make_request(get)
-        return _attribute(blk, "number")
+        number = _attribute(blk, "number")
+        self._observe_best(number)
+        return number
 
     async def get_block_id(self, block_identifier):
         blk = await self.blocks(block_identifier).make_request(get)
@@ -95,7 +282,10 @@ class ThorClient(object, metaclass=Singleton):
             raise ValueError("Gas estimation failed.")
         return int(result["gasUsed"] * 1.2) + intrinsic_gas(transaction)
 
-    async def call(self, transaction, block_identifier):
+    async def call(self, transaction, block_identifier, batcher=None):
+        batcher = batcher or current_batcher() or self.call_batcher
+        if batcher is not None and is_batchable(transaction):
+            return await batcher.call(self, transaction, block_identifier)
         params = {
             "revision": block_identifier,
         }
@@ -104,13 +294,18 @@ class ThorClient(object, metaclass=Singleton):
             "value": (encode_number(transaction.get("value", 0))).decode("utf-8"),
             "caller": transaction.get("from", None),
         }
-        result = await self.accounts(transaction.get("to", None)).make_request(
-            post, data=data, params=params)
-        return _attribute(result, "data")
+        return await self.accounts(transaction.get("to", None)).make_field_request(
+            post, "data", data=data, params=params)
+
+    async def multi_call(self, transactions, block_identifier):
+        batcher = CallBatcher()
+        return await asyncio.gather(*[
+            self.call(transaction, block_identifier, batcher) for transaction in transactions
+        ])
 
     async def send_transaction(self, transaction):
-        chain_tag = int((await thor.get_block(0))["hash"][-2:], 16)
-        blk_ref = int(strip_0x((await thor.get_block("best"))["hash"])[:8], 16)
+        chain_tag = int((await self.get_block(0))["hash"][-2:], 16)
+        blk_ref = int(strip_0x((await self.get_block("best"))["hash"])[:8], 16)
         tx = ThorTransaction(chain_tag, blk_ref, transaction)
         tx.sign(self.account_manager.get_priv_by_addr(transaction["from"]))
         raw = "0x{}".format(encode_hex(rlp.encode(tx)))
@@ -121,33 +316,91 @@ class ThorClient(object, metaclass=Singleton):
             "raw": raw
         }
         result = await self.transactions.make_request(post, data=data)
-        return _attribute(result, "id")
+        tx_id = _attribute(result, "id")
+        if self.receipt_watcher is not None:
+            self.receipt_watcher.track(tx_id)
+        return tx_id
 
     async def get_transaction_by_hash(self, tx_hash):
+        if self.prefetcher is not None:
+            prefetched = self.prefetcher.get_transaction(tx_hash)
+            if prefetched is not None:
+                return prefetched
+        cached = self._cache_get("tx {}".format(tx_hash.lower()))
+        if cached is not None:
+            return cached
+        if self.store is not None:
+            stored = await self.store.worker.run(self.store.get_transaction, tx_hash)
+            if stored is not None:
+                self._cache_put("tx {}".format(tx_hash.lower()), stored)
+                return stored
         tx = await self.transactions(tx_hash).make_request(get)
-        return None if tx is None else thor_tx_convert_to_eth_tx(tx)
+        if tx is None:
+            return None
+        result = thor_tx_convert_to_eth_tx(tx)
+        await self._keep(tx["meta"]["blockNumber"], "tx", tx_hash, result)
+        return result
 
     async def get_balance(self, address, block_identifier):
         params = {
             "revision": block_identifier
         }
-        accout = await self.accounts(address).make_request(get, params=params)
-        return _attribute(accout, "balance")
+        return await self.accounts(address).make_field_request(get, "balance", params=params)
 
     async def get_transaction_receipt(self, tx_hash):
+        if self.receipt_watcher is not None:
+            known, receipt = self.receipt_watcher.lookup(tx_hash)
+            if known:
+                return receipt
+        if self.prefetcher is not None:
+            prefetched = self.prefetcher.get_receipt(tx_hash)
+            if prefetched is not None:
+                return prefetched
+        cached = self._cache_get("receipt {}".format(tx_hash.lower()))
+        if cached is not None:
+            return cached
+        if self.store is not None:
+            stored = await self.store.worker.run(self.store.get_receipt, tx_hash)
+            if stored is not None:
+                self._cache_put("receipt {}".format(tx_hash.lower()), stored)
+                return stored
         receipt = await self.transactions(tx_hash).receipt.make_request(get)
-        return None if receipt is None else thor_receipt_convert_to_eth_receipt(receipt)
+        if receipt is None:
+            return None
+        result = await offloader.run(
+            sum(len(o["events"]) for o in receipt.get("outputs") or []),
+            thor_receipt_convert_to_eth_receipt, receipt)
+        await self._keep(receipt["meta"]["blockNumber"], "receipt", tx_hash, result)
+        return result
 
     async def get_block(self, block_identifier):
+        if self.prefetcher is not None:
+            prefetched = self.prefetcher.get_block(block_identifier)
+            if prefetched is not None:
+                return prefetched
+        cached = self._cached_block(block_identifier)
+        if cached is not None:
+            return cached
+        if self.store is not None:
+            stored = await self.store.worker.run(self.store.get_block, block_identifier)
+            if stored is not None:
+                self._cache_block(int(stored["number"], 16), stored["hash"], stored)
+                return stored
         blk = await self.blocks(block_identifier).make_request(get)
-        return None if blk is None else thor_block_convert_to_eth_block(blk)
+        if blk is None:
+            return None
+        if block_identifier == "best":
+            self._observe_best(blk["number"])
+        result = thor_block_convert_to_eth_block(blk)
+        if blk.get("isTrunk", True):
+            await self._keep(blk["number"], "block", blk["id"], result)
+        return result
 
     async def get_code(self, address, block_identifier):
         params = {
             "revision": block_identifier
         }
-        code = await self.accounts(address).code.make_request(get, params=params)
-        return _attribute(code, "code")
+        return await self.accounts(address).code.make_field_request(get, "code", params=params)
 
     async def new_block_filter(self):
         filter_id = "0x{}".format(uuid.uuid4().hex)
@@ -164,9 +417,17 @@ class ThorClient(object, metaclass=Singleton):
         func = self.filter.get(filter_id)
         return await func() if func else []
 
-    async def get_logs(self, address, query):
-        logs = await self.logs.event.make_request(post, data=query)
-        result = thor_log_convert_to_eth_log(address, logs)
+    async def get_logs(self, address, query, topics=None):
+        local = None
+        if self.event_index is not None:
+            local, query = self.event_index.split(query, self.best_number)
+        logs = [] if local is None else await self.event_index.worker.run(self.event_index.query, local)
+        if query is not None:
+            upstream = await self.logs.event.make_request(post, data=query) or []
+            logs = upstream + logs if query.get("order") == "desc" else logs + upstream
+        if topics:
+            logs = [log for log in logs if match_topics(log["topics"], topics)]
+        result = await offloader.run(len(logs), thor_log_convert_to_eth_log, address, logs)
         return result
 
 
@@ -193,4 +454,31 @@ class BlockFilter(object):
         return result
 
 
-thor = ThorClient()
+_current = contextvars.ContextVar("thor_client")
+
+
+def use_client(client):
+    '''
+    Route `thor` to `client` for the rest of the current request.
+    '''
+    return _current.set(client)
+
+
+def reset_client(token):
+    _current.reset(token)
+
+
+class CurrentClient(object):
+    '''
+    Forwards to the ThorClient serving the current request, or to `default` outside of one.
+    '''
+
+    def __init__(self, default):
+        super(CurrentClient, self).__init__()
+        self.default = default
+
+    def __getattr__(self, name):
+        return getattr(_current.get(self.default), name)
+
+
+thor = CurrentClient(ThorClient())
@@ -0,0 +1,41 @@
+import asyncio
+from gear.utils.accesslog import access_log
+
+
+class HeadWatcher(object):
+    '''
+    Polls the best block and notifies subscribers with (previous, best) whenever it advances.
+    '''
+
+    def __init__(self, client, interval=1):
+        super(HeadWatcher, self).__init__()
+        self.client = client
+        self.interval = interval
+        self.number = None
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    async def poll(self):
+        best = await self.client.get_block_number()
+        if best is None or (self.number is not None and best <= self.number):
+            return
+        previous, self.number = self.number, best
+        for callback in self.subscribers:
+            try:
+                await callback(previous, best)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                access_log.error("head subscriber failed", exc_info=True)
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                access_log.error("head poll failed", exc_info=True)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,229 @@
+import asyncio
+import sqlite3
+from gear.utils.accesslog import access_log
+from gear.utils.thread import Worker
+from .request import post
+
+
+TOPICS = ["topic{}".format(i) for i in range(5)]
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    block_number INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    block_id TEXT NOT NULL,
+    block_timestamp INTEGER NOT NULL,
+    tx_id TEXT NOT NULL,
+    tx_origin TEXT NOT NULL,
+    clause_index INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    topic0 TEXT,
+    topic1 TEXT,
+    topic2 TEXT,
+    topic3 TEXT,
+    topic4 TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (block_number, seq)
+);
+CREATE INDEX IF NOT EXISTS events_address ON events (address, block_number);
+CREATE INDEX IF NOT EXISTS events_topic0 ON events (topic0, block_number);
+CREATE INDEX IF NOT EXISTS events_topic1 ON events (topic1, block_number);
+CREATE INDEX IF NOT EXISTS events_topic2 ON events (topic2, block_number);
+CREATE INDEX IF NOT EXISTS events_topic3 ON events (topic3, block_number);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+
+def _lower(value):
+    return None if value is None else value.lower()
+
+
+def _row_to_thor_log(row):
+    (block_number, _, block_id, block_timestamp, tx_id, tx_origin, clause_index,
+     address, topic0, topic1, topic2, topic3, topic4, data) = row
+    return {
+        "address": address,
+        "topics": [t for t in (topic0, topic1, topic2, topic3, topic4) if t is not None],
+        "data": data,
+        "meta": {
+            "blockID": block_id,
+            "blockNumber": block_number,
+            "blockTimestamp": block_timestamp,
+            "txID": tx_id,
+            "txOrigin": tx_origin,
+            "clauseIndex": clause_index,
+        },
+    }
+
+
+class EventIndex(object):
+    '''
+    Follows the chain and indexes finalized events by address and topics, so `logs/event`
+    queries over the indexed range are answered from SQLite instead of Thor. The addresses
+    and start block are recorded with the events, and an index built for others is refused,
+    since it lacks their events. A `start` of None continues from the recorded one. An index
+    of another chain than `genesis`, such as a reset solo node, is emptied. Ingestion and
+    queries run in `worker`, off the event loop.
+    '''
+
+    def __init__(self, path, addresses=None, start=None, finality=12, chunk_size=1000, page_size=1000,
+                 genesis=None):
+        super(EventIndex, self).__init__()
+        self.addresses = sorted(set(a.lower() for a in addresses or []))
+        self.finality = finality
+        self.chunk_size = chunk_size
+        self.page_size = page_size
+        self.worker = Worker("index")
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.start = self._meta("start", 0 if start is None else start)
+        indexed = ",".join(self.addresses)
+        recorded = self._meta("addresses", indexed)
+        if recorded != indexed or start is not None and start != self.start:
+            self.db.close()
+            raise ValueError("{} indexes {} from block {}, use another file to index {} from block {}".format(
+                path, recorded or "all addresses", self.start, indexed or "all addresses",
+                self.start if start is None else start))
+        if genesis is not None:
+            self._check_genesis(genesis.lower())
+        self.indexed_to = self._meta("indexed_to", self.start - 1)
+        self.advanced = None
+
+    def _meta(self, key, default):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, default))
+        return default
+
+    def _check_genesis(self, genesis):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'genesis'").fetchone()
+        if row is not None and row[0] == genesis:
+            return
+        with self.db:
+            self.db.execute("BEGIN")
+            if row is not None:
+                access_log.error("event index belongs to another chain, emptying it", genesis=row[0])
+            self.db.execute("DELETE FROM events")
+            self.db.execute("DELETE FROM meta WHERE key = 'indexed_to'")
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('genesis', ?)", (genesis,))
+
+    #
+    # ingestion
+    #
+    async def on_head(self, previous, best):
+        if self.advanced is not None:
+            self.advanced.set()
+
+    async def run(self, client):
+        self.advanced = asyncio.Event()
+        while True:
+            await self.advanced.wait()
+            self.advanced.clear()
+            try:
+                await self.catch_up(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                access_log.error("event index catch-up failed", exc_info=True)
+
+    async def catch_up(self, client):
+        if client.best_number is None:
+            return
+        target = client.best_number - self.finality
+        while self.indexed_to < target:
+            to = min(self.indexed_to + self.chunk_size, target)
+            logs = await self._fetch(client, self.indexed_to + 1, to)
+            await self.worker.run(self._ingest, logs, to)
+
+    async def _fetch(self, client, frm, to):
+        query = {
+            "range": {"unit": "block", "from": frm, "to": to},
+            "criteriaSet": [{"address": a} for a in self.addresses],
+            "order": "asc",
+        }
+        result = []
+        offset = 0
+        while True:
+            query["options"] = {"offset": offset, "limit": self.page_size}
+            page = await client.logs.event.make_request(post, data=query) or []
+            result.extend(page)
+            if len(page) < self.page_size:
+                return result
+            offset += len(page)
+
+    def _ingest(self, logs, indexed_to):
+        seq = {}
+        rows = []
+        for log in logs:
+            meta = log["meta"]
+            number = meta["blockNumber"]
+            seq[number] = seq.get(number, -1) + 1
+            topics = [_lower(t) for t in log["topics"]] + [None] * (5 - len(log["topics"]))
+            rows.append((
+                number, seq[number], meta["blockID"], meta["blockTimestamp"], meta["txID"],
+                meta["txOrigin"], meta["clauseIndex"], log["address"].lower(), *topics, log["data"],
+            ))
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.execute("UPDATE meta SET value = ? WHERE key = 'indexed_to'", (indexed_to,))
+        self.indexed_to = indexed_to
+
+    #
+    # query
+    #
+    def _covers(self, criteria_set):
+        if not self.addresses:
+            return True
+        if not criteria_set:
+            return False
+        return all(_lower(c.get("address")) in self.addresses for c in criteria_set)
+
+    def split(self, query, best_number=None):
+        '''
+        Split a `logs/event` query into the part served locally and the part left for Thor.
+        Either may be None.
+        '''
+        params_range = query.get("range", {})
+        if params_range.get("unit", "block") != "block" or "options" in query:
+            return None, query
+        frm = params_range.get("from", 0)
+        to = params_range.get("to", best_number)
+        if frm < self.start or frm > self.indexed_to or not self._covers(query.get("criteriaSet")):
+            return None, query
+        local_to = self.indexed_to if to is None else min(to, self.indexed_to)
+        local = dict(query, range={"unit": "block", "from": frm, "to": local_to})
+        if to is not None and to <= self.indexed_to:
+            return local, None
+        rest_range = {"unit": "block", "from": self.indexed_to + 1}
+        if "to" in params_range:
+            rest_range["to"] = params_range["to"]
+        return local, dict(query, range=rest_range)
+
+    def query(self, query):
+        params_range = query["range"]
+        sql = "SELECT * FROM events WHERE block_number BETWEEN ? AND ?"
+        args = [params_range["from"], params_range["to"]]
+        clauses = []
+        for criteria in query.get("criteriaSet") or []:
+            terms = []
+            for key in ["address"] + TOPICS:
+                value = criteria.get(key)
+                if value is not None:
+                    terms.append("{} = ?".format(key))
+                    args.append(value.lower())
+            clauses.append("(" + " AND ".join(terms) + ")" if terms else "1")
+        if clauses:
+            sql += " AND (" + " OR ".join(clauses) + ")"
+        if query.get("order") == "desc":
+            sql += " ORDER BY block_number DESC, seq DESC"
+        else:
+            sql += " ORDER BY block_number, seq"
+        return [_row_to_thor_log(row) for row in self.db.execute(sql, args)]
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from gear.utils.compat import (
+    expanded_tx_to_thor_tx,
+    expanded_tx_to_thor_receipt,
+    thor_block_convert_to_eth_block,
+    thor_tx_convert_to_eth_tx,
+    thor_receipt_convert_to_eth_receipt,
+)
+from gear.utils.thread import offloader
+from gear.utils.types import force_obj_to_text
+from .request import get
+from .store import block_key
+
+
+def convert_expanded_block(blk):
+    '''
+    The converted block, transactions and receipts of an expanded block.
+    '''
+    block = thor_block_convert_to_eth_block(dict(blk, transactions=[tx["id"] for tx in blk["transactions"]]))
+    txs = {}
+    receipts = {}
+    for tx in blk["transactions"]:
+        key = tx["id"].lower()
+        txs[key] = thor_tx_convert_to_eth_tx(expanded_tx_to_thor_tx(blk, tx))
+        receipts[key] = thor_receipt_convert_to_eth_receipt(expanded_tx_to_thor_receipt(blk, tx))
+    return force_obj_to_text((block, txs, receipts), True)
+
+
+class Prefetcher(object):
+    '''
+    Fetches each new block with its transactions and receipts in one expanded request as the
+    best block advances, and keeps them converted for the last `keep_blocks` blocks so the
+    reads that follow a new block are served warm. A new block whose parent is not the kept
+    block before it means a reorganization, and everything kept is dropped. Returned objects
+    are shared and must not be modified.
+    '''
+
+    def __init__(self, client, keep_blocks=12):
+        super(Prefetcher, self).__init__()
+        self.client = client
+        self.keep_blocks = keep_blocks
+        self.blocks = OrderedDict()
+        self.ids = {}
+        self.txs = {}
+        self.receipts = {}
+
+    def get_block(self, block_identifier):
+        key = block_key(block_identifier)
+        if key is None:
+            return None
+        column, value = key
+        number = self.ids.get(value) if column == "id" else value
+        entry = self.blocks.get(number)
+        return None if entry is None else entry[1]
+
+    def get_transaction(self, tx_hash):
+        entry = self.txs.get(tx_hash.lower())
+        return None if entry is None else entry[1]
+
+    def get_receipt(self, tx_hash):
+        entry = self.receipts.get(tx_hash.lower())
+        return None if entry is None else entry[1]
+
+    async def on_head(self, previous, best):
+        start = best if previous is None else max(previous + 1, best - self.keep_blocks + 1)
+        for number in range(start, best + 1):
+            await self._fetch(number)
+        while self.blocks and next(iter(self.blocks)) <= best - self.keep_blocks:
+            self._drop(next(iter(self.blocks)))
+
+    async def _fetch(self, number):
+        blk = await self.client.blocks(number).make_request(get, params={"expanded": "true"})
+        if blk is None:
+            return
+        parent = self.blocks.get(number - 1)
+        if number in self.blocks or parent is not None and parent[0] != blk["parentID"].lower():
+            self.clear()
+        block, txs, receipts = await offloader.run(
+            len(blk["transactions"]), convert_expanded_block, blk)
+        self.blocks[number] = (blk["id"].lower(), block, list(txs))
+        self.ids[blk["id"].lower()] = number
+        for key, tx in txs.items():
+            self.txs[key] = (number, tx)
+            self.receipts[key] = (number, receipts[key])
+
+    def _drop(self, number):
+        block_id, _, tx_ids = self.blocks.pop(number)
+        self.ids.pop(block_id, None)
+        for key in tx_ids:
+            if self.txs.get(key, (None,))[0] == number:
+                del self.txs[key]
+                del self.receipts[key]
+
+    def clear(self):
+        self.blocks.clear()
+        self.ids.clear()
+        self.txs.clear()
+        self.receipts.clear()
@@ -0,0 +1,119 @@
+import json
+import time
+import queue
+import asyncio
+from threading import Thread
+from gear.utils.accesslog import access_log
+
+
+def exchange_key(method, url, params=None, data=None):
+    return json.dumps([method, url, params, data], sort_keys=True, separators=(",", ":"))
+
+
+class Recorder(object):
+    '''
+    Appends inbound JSON-RPC requests ("rpc") and upstream request/response pairs
+    ("upstream") with their timings to a JSON-lines file. Like the access log, entries go
+    through a bounded queue to a writer thread and are dropped, counted in `dropped`, when
+    it is full.
+    '''
+
+    def __init__(self, path, max_queue=10000):
+        super(Recorder, self).__init__()
+        self.file = open(path, "a", encoding="utf-8")
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.writer = Thread(target=self._write, name="recorder", daemon=True)
+        self.writer.start()
+
+    def _write(self):
+        while True:
+            entries = [self.queue.get()]
+            while entries[-1] is not None and len(entries) < 1000:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.file.write("".join(
+                json.dumps(e, separators=(",", ":")) + "\n" for e in entries if e is not None))
+            self.file.flush()
+            if entries[-1] is None:
+                return
+
+    def record(self, kind, **fields):
+        fields["kind"] = kind
+        fields["time"] = time.time()
+        try:
+            self.queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # let the writer drain the queue first
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+        if self.dropped:
+            access_log.error("recorder dropped entries", dropped=self.dropped)
+
+
+class RecordedResponse(object):
+    '''
+    The subset of `aiohttp.ClientResponse` used by Restful, backed by a recorded body.
+    '''
+
+    def __init__(self, status, body):
+        super(RecordedResponse, self).__init__()
+        self.status = status
+        self._body = body.encode("utf-8")
+        self.content = self
+
+    async def read(self):
+        return self._body
+
+    async def text(self):
+        return self._body.decode("utf-8")
+
+    async def json(self):
+        return json.loads(self._body)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise Exception(self._body.decode("utf-8"))
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self._body), size):
+            yield self._body[i:i + size]
+
+    def release(self):
+        pass
+
+
+class Replay(object):
+    '''
+    Serves upstream responses from a recording. Identical requests are answered with their
+    recorded responses in order, repeating the last one once exhausted. With `speed` > 0 each
+    answer is delayed by its recorded latency divided by `speed`.
+    '''
+
+    def __init__(self, path, speed=0):
+        super(Replay, self).__init__()
+        self.speed = speed
+        self.exchanges = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["kind"] != "upstream":
+                    continue
+                key = exchange_key(entry["method"], entry["url"], entry.get("params"), entry.get("data"))
+                self.exchanges.setdefault(key, []).append(entry)
+
+    async def respond(self, method, url, params=None, data=None):
+        key = exchange_key(method, url, params, data)
+        entries = self.exchanges.get(key)
+        if not entries:
+            raise Exception("No recorded response for {} {}".format(method.upper(), url))
+        entry = entries.pop(0) if len(entries) > 1 else entries[0]
+        if self.speed > 0:
+            await asyncio.sleep(entry["elapsed"] / self.speed)
+        return RecordedResponse(entry["status"], entry["body"])
@@ -1,50 +1,209 @@
+import re
+import json
+import time
+import asyncio
 import aiohttp
+from gear.utils.deadline import remaining
+from gear.utils.accesslog import access_log
+from .recorder import RecordedResponse
 
 
-async def post(endpoint_uri, data, **kwargs):
+# upstream timeout in seconds of requests served without a deadline, which otherwise bounds them
+TIMEOUT = 10
+
+
+def _timeout():
+    timeout = remaining(TIMEOUT)
+    if timeout <= 0:
+        raise asyncio.TimeoutError("request deadline exceeded")
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+HEADERS = {
+    "accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+    "Content-Type": "application/json"
+}
+
+
+async def post(endpoint_uri, data, session=None, **kwargs):
+    if session is not None:
+        return await session.post(endpoint_uri, json=data, **kwargs)
     async with aiohttp.ClientSession() as session:
         return await session.post(endpoint_uri, json=data, **kwargs)
 
 
-async def get(endpoint_uri, params, **kwargs):
+async def get(endpoint_uri, params, session=None, **kwargs):
+    if session is not None:
+        return await session.get(endpoint_uri, params=params, **kwargs)
     async with aiohttp.ClientSession() as session:
         return await session.get(endpoint_uri, params=params, **kwargs)
 
 
+_NESTED = re.compile(rb"[\[{]")
+_WHITESPACE = b" \t\r\n"
+
+
+def json_field(body, key):
+    '''
+    Extract a top-level string field from a JSON object without decoding the whole document,
+    falling back to `json.loads` for anything other than a plain string or null.
+    '''
+    token = b'"' + key.encode("utf-8") + b'":'
+    start = body.find(b"{")
+    index = body.find(token)
+    if start != -1 and index != -1 and _NESTED.search(body, start + 1, index) is None:
+        index += len(token)
+        while body[index:index + 1] in _WHITESPACE:
+            index += 1
+        if body.startswith(b"null", index):
+            return None
+        if body.startswith(b'"', index):
+            end = body.find(b'"', index + 1)
+            value = body[index + 1:end]
+            if end != -1 and b"\\" not in value:
+                return value.decode("utf-8")
+    obj = json.loads(body)
+    return None if obj is None else obj[key]
+
+
+# responses of an overloaded Thor node or of a proxy in front of it
+OVERLOAD_STATUS = (429, 502, 503, 504)
+
+
+class UpstreamError(Exception):
+    '''
+    An error response of Thor, carrying its HTTP status.
+    '''
+
+    def __init__(self, message, status):
+        super(UpstreamError, self).__init__(message)
+        self.status = status
+
+
+async def _read_json(response):
+    return await response.json()
+
+
+class Upstream(object):
+    '''
+    Connection pool to one Thor endpoint, shared by all Restful resources derived from it.
+    '''
+
+    def __init__(self, limit=100, recorder=None, replay=None, limiter=None):
+        super(Upstream, self).__init__()
+        self.limit = limit
+        self.recorder = recorder
+        self.replay = replay
+        self.limiter = limiter
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def send(self, method, url, params=None, data=None, **kwargs):
+        if self.limiter is None:
+            return await self._send(method, url, params, data, **kwargs)
+        await self.limiter.acquire()
+        in_flight = self.limiter.active
+        start = time.monotonic()
+        try:
+            response = await self._send(method, url, params, data, **kwargs)
+        except asyncio.TimeoutError:
+            self.limiter.on_overload()
+            raise
+        finally:
+            self.limiter.release()
+        if response.status in OVERLOAD_STATUS:
+            self.limiter.on_overload()
+        else:
+            self.limiter.on_success(time.monotonic() - start, in_flight)
+        return response
+
+    async def _send(self, method, url, params=None, data=None, **kwargs):
+        if self.replay is not None:
+            return await self.replay.respond(method.__name__, url, params, data)
+        start = time.monotonic()
+        response = await method(url, params=params, data=data, session=self.session, **kwargs)
+        if self.recorder is not None:
+            body = (await response.read()).decode("utf-8")
+            self.recorder.record(
+                "upstream", method=method.__name__, url=url, params=params, data=data,
+                status=response.status, body=body, elapsed=time.monotonic() - start)
+            response.release()
+            return RecordedResponse(response.status, body)
+        return response
+
+
 class Restful(object):
 
-    def __init__(self, endpoint):
+    def __init__(self, endpoint, upstream=None):
         super(Restful, self).__init__()
         self._endpoint = endpoint
+        self._upstream = Upstream() if upstream is None else upstream
 
     def __call__(self, parameter):
         if parameter is not None:
-            return Restful('%s/%s' % (self._endpoint, parameter))
+            return Restful('%s/%s' % (self._endpoint, parameter), self._upstream)
         return self
 
     def __getattr__(self, resource):
-        return Restful('%s/%s' % (self._endpoint, resource))
+        return Restful('%s/%s' % (self._endpoint, resource), self._upstream)
 
     async def make_request(self, method, params=None, data=None, **kwargs):
-        headers = {
-            "accept": "application/json",
-            "Connection": "keep-alive",
-            "Content-Type": "application/json"
-        }
-        kwargs.setdefault('headers', headers)
-        kwargs.setdefault('timeout', 10)
+        return await self._request(method, _read_json, params=params, data=data, **kwargs)
+
+    async def make_field_request(self, method, key, params=None, data=None, **kwargs):
+        '''
+        Like `make_request`, but only returns the top-level field `key` of the response.
+        '''
+        async def read(response):
+            if response.status >= 400:
+                raise UpstreamError((await response.text()).strip('\n'), response.status)
+            return json_field(await response.read(), key)
+        return await self._request(method, read, params=params, data=data, **kwargs)
+
+    async def stream_request(self, method, params=None, data=None, chunk_size=64 * 1024, **kwargs):
+        '''
+        Yield the raw response body in chunks instead of decoding it.
+        '''
+        kwargs.setdefault('headers', HEADERS)
+        kwargs.setdefault('timeout', _timeout())
+        response = await self._upstream.send(method, self._endpoint, params=params, data=data, **kwargs)
+        try:
+            if response.status >= 400:
+                raise UpstreamError((await response.text()).strip('\n'), response.status)
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            response.release()
+
+    async def _request(self, method, read, params=None, data=None, **kwargs):
+        kwargs.setdefault('headers', HEADERS)
+        kwargs.setdefault('timeout', _timeout())
         error = None
+        message = "Thor-Restful server Err:"
         try:
-            response = await method(self._endpoint, params=params, data=data, **kwargs)
-            return await response.json()
+            response = await self._upstream.send(method, self._endpoint, params=params, data=data, **kwargs)
+            return await read(response)
         except aiohttp.ClientConnectionError as e:
-            print("Unable to connect to Thor-Restful server:")
+            message = "Unable to connect to Thor-Restful server:"
+            error = e
+        except UpstreamError as e:
             error = e
         except Exception as e:
             try:
                 text = await response.text()
-                error = Exception(text.strip('\n'))
+                error = UpstreamError(text.strip('\n'), response.status)
             except:
                 error = e
-        print("Thor-Restful server Err:")
+        access_log.error(message, url=self._endpoint, error=str(error))
         raise error
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+from gear.utils.types import force_obj_to_text
+from gear.utils.accesslog import access_log
+from gear.utils.thread import Worker
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blocks (
+    id TEXT PRIMARY KEY,
+    number INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS blocks_number ON blocks (number);
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS receipts (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+def _dumps(obj):
+    return json.dumps(force_obj_to_text(obj, True), separators=(",", ":"))
+
+
+def block_key(block_identifier):
+    '''
+    Map a block identifier to a (column, value) lookup, or None if it can't be served locally.
+    '''
+    if isinstance(block_identifier, int):
+        return "number", block_identifier
+    if not isinstance(block_identifier, str):
+        return None
+    if len(block_identifier) == 66:
+        return "id", block_identifier.lower()
+    if block_identifier.startswith("0x"):
+        return "number", int(block_identifier, 16)
+    if block_identifier.isdigit():
+        return "number", int(block_identifier)
+    return None
+
+
+class ChainStore(object):
+    '''
+    Persists converted blocks, transactions and receipts past the finality depth in SQLite.
+    The store belongs to the chain of `genesis`, and is emptied when opened for another one,
+    such as a reset solo node. Callers on the event loop go through `worker`, which keeps
+    SQLite off the loop.
+    '''
+
+    def __init__(self, path, finality=12, genesis=None):
+        super(ChainStore, self).__init__()
+        self.finality = finality
+        self.worker = Worker("store")
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        if genesis is not None:
+            self._check_genesis(genesis.lower())
+
+    def _check_genesis(self, genesis):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'genesis'").fetchone()
+        if row is not None and row[0] == genesis:
+            return
+        with self.db:
+            self.db.execute("BEGIN")
+            if row is not None:
+                access_log.error("store belongs to another chain, emptying it", genesis=row[0])
+            self.db.execute("DELETE FROM blocks")
+            self.db.execute("DELETE FROM transactions")
+            self.db.execute("DELETE FROM receipts")
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('genesis', ?)", (genesis,))
+
+    def _get(self, sql, *args):
+        row = self.db.execute(sql, args).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_block(self, block_identifier):
+        key = block_key(block_identifier)
+        if key is None:
+            return None
+        column, value = key
+        return self._get("SELECT data FROM blocks WHERE {} = ?".format(column), value)
+
+    def put_block(self, number, block_id, blk):
+        self.db.execute(
+            "INSERT OR REPLACE INTO blocks (id, number, data) VALUES (?, ?, ?)",
+            (block_id.lower(), number, _dumps(blk)))
+
+    def get_transaction(self, tx_hash):
+        return self._get("SELECT data FROM transactions WHERE id = ?", tx_hash.lower())
+
+    def put_transaction(self, tx_hash, tx):
+        self.db.execute(
+            "INSERT OR REPLACE INTO transactions (id, data) VALUES (?, ?)",
+            (tx_hash.lower(), _dumps(tx)))
+
+    def get_receipt(self, tx_hash):
+        return self._get("SELECT data FROM receipts WHERE id = ?", tx_hash.lower())
+
+    def put_receipt(self, tx_hash, receipt):
+        self.db.execute(
+            "INSERT OR REPLACE INTO receipts (id, data) VALUES (?, ?)",
+            (tx_hash.lower(), _dumps(receipt)))
+
+    def close(self):
+        self.worker.close()
+        self.db.close()
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from gear.utils.compat import (
+    expanded_tx_to_thor_receipt,
+    thor_receipt_convert_to_eth_receipt,
+)
+from .request import get
+
+
+class ReceiptWatcher(object):
+    '''
+    Tracks transactions sent through the gear and looks for them once per new block, so
+    receipt polls for them are answered from memory: None while pending, then the receipt.
+    Transactions not seen within `max_blocks`, and receipts older than `keep_blocks`, are
+    forgotten and left to Thor again. Blocks a `prefetcher` notified first already holds are
+    not fetched again.
+    '''
+
+    def __init__(self, client, max_blocks=30, keep_blocks=30, max_pending=10000, prefetcher=None):
+        super(ReceiptWatcher, self).__init__()
+        self.client = client
+        self.prefetcher = prefetcher
+        self.max_blocks = max_blocks
+        self.keep_blocks = keep_blocks
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.receipts = OrderedDict()
+        # ids of the blocks checked recently, by number
+        self.ids = OrderedDict()
+        self.number = None
+        self.checked = None
+
+    def track(self, tx_id):
+        if tx_id is None:
+            return
+        self.pending[tx_id.lower()] = self.number
+        while len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+
+    def lookup(self, tx_id):
+        '''
+        Returns (known, receipt).
+        '''
+        key = tx_id.lower()
+        if key in self.receipts:
+            return True, self.receipts[key][1]
+        return key in self.pending, None
+
+    async def on_head(self, previous, best):
+        self.number = best
+        try:
+            if self.pending or self.receipts:
+                # resume after the last block checked, which a failed check leaves behind
+                start = best if self.checked is None else max(self.checked + 1, best - self.max_blocks)
+                for number in range(start, best + 1):
+                    await self._check(number)
+                    self.checked = number
+            else:
+                self.checked = best
+                self.ids.clear()
+        finally:
+            for tx_id, since in list(self.pending.items()):
+                if since is not None and best - since > self.max_blocks:
+                    del self.pending[tx_id]
+            for tx_id, (number, _) in list(self.receipts.items()):
+                if best - number <= self.keep_blocks:
+                    break
+                del self.receipts[tx_id]
+            while self.ids and next(iter(self.ids)) < best - self.keep_blocks:
+                self.ids.popitem(last=False)
+
+    async def _check(self, number):
+        if self.prefetcher is not None and number in self.prefetcher.blocks:
+            block_id, blk, tx_ids = self.prefetcher.blocks[number]
+            self._follow(number, block_id, blk["parentHash"])
+            for key in tx_ids:
+                if key in self.pending:
+                    del self.pending[key]
+                    self.receipts[key] = (number, self.prefetcher.get_receipt(key))
+            return
+        blk = await self.client.blocks(number).make_request(get, params={"expanded": "true"})
+        if blk is None:
+            return
+        self._follow(number, blk["id"], blk["parentID"])
+        for tx in blk["transactions"]:
+            key = tx["id"].lower()
+            if key in self.pending:
+                del self.pending[key]
+                receipt = expanded_tx_to_thor_receipt(blk, tx)
+                self.receipts[key] = (number, thor_receipt_convert_to_eth_receipt(receipt))
+
+    def _follow(self, number, block_id, parent_id):
+        '''
+        A block whose parent is not the block checked before it means a reorganization, which
+        may have dropped the blocks of the receipts kept, so they are left to Thor again.
+        '''
+        if self.ids.get(number - 1, parent_id.lower()) != parent_id.lower():
+            self.receipts.clear()
+            self.ids.clear()
+        self.ids[number] = block_id.lower()
@@ -0,0 +1,74 @@
+import sys
+import json
+import time
+import queue
+import random
+import traceback
+from threading import Thread
+
+
+class AccessLog(object):
+    '''
+    Structured JSON-lines log of requests and errors. Records are handed to a writer thread
+    through a bounded queue and dropped, with a count kept in `dropped`, when it is full, so
+    logging never blocks the event loop. Requests are kept with their method's sampling rate
+    (`rates`, `"*"` for the rest) and only when slower than `slow` seconds; errors always are.
+    Until configured, errors are printed as before and requests are not logged.
+    '''
+
+    def __init__(self):
+        super(AccessLog, self).__init__()
+        self.queue = None
+        self.dropped = 0
+
+    def configure(self, path, rates=None, slow=0, max_queue=10000):
+        self.rates = dict(rates or {})
+        self.default_rate = self.rates.pop("*", 1.0)
+        self.slow = slow
+        self.file = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+        self.queue = queue.Queue(max_queue)
+        writer = Thread(target=self._write, name="access-log", daemon=True)
+        writer.start()
+
+    def _write(self):
+        while True:
+            records = [self.queue.get()]
+            # write what has piled up in one go and flush once
+            while len(records) < 1000:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.file.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+            self.file.flush()
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def sampled(self, methods):
+        rate = max([self.rates.get(m, self.default_rate) for m in methods] or [self.default_rate])
+        return rate >= 1 or random.random() < rate
+
+    def access(self, methods, elapsed, outcome="ok", **fields):
+        if self.queue is None or elapsed < self.slow and outcome == "ok" or not self.sampled(methods):
+            return
+        self._put(dict(
+            kind="access", time=time.time(), methods=methods, elapsed=round(elapsed * 1000, 3),
+            outcome=outcome, **fields))
+
+    def error(self, message, exc_info=False, **fields):
+        if self.queue is None:
+            print(message)
+            if exc_info:
+                traceback.print_exc()
+            return
+        record = dict(kind="error", time=time.time(), message=message, **fields)
+        if exc_info:
+            record["traceback"] = traceback.format_exc()
+        self._put(record)
+
+
+access_log = AccessLog()
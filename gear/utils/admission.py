@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import asyncio
+
+
+# lower priority value is served first
+DEFAULT_CLASSES = {
+    "light": {"priority": 0, "concurrency": 0, "queue": 1024},
+    "normal": {"priority": 1, "concurrency": 0, "queue": 256},
+    "heavy": {"priority": 2, "concurrency": 4, "queue": 32},
+}
+
+
+DEFAULT_METHODS = {
+    "eth_blockNumber": "light",
+    "eth_getTransactionReceipt": "light",
+    "eth_getTransactionByHash": "light",
+    "eth_getTransactionCount": "light",
+    "eth_getBalance": "light",
+    "eth_accounts": "light",
+    "eth_getFilterChanges": "light",
+    "net_version": "light",
+    "net_listening": "light",
+    "web3_clientVersion": "light",
+    "rpc_modules": "light",
+    "eth_getLogs": "heavy",
+    "debug_traceTransaction": "heavy",
+    "debug_storageRangeAt": "heavy",
+    "gear_getBlockRange": "heavy",
+}
+
+
+class Rejected(Exception):
+    pass
+
+
+class MethodClass(object):
+
+    def __init__(self, name, priority=1, concurrency=0, queue=0):
+        super(MethodClass, self).__init__()
+        self.name = name
+        self.priority = priority
+        self.concurrency = concurrency
+        self.queue = queue
+        self.active = 0
+        self.queued = 0
+
+    def has_capacity(self):
+        return self.concurrency <= 0 or self.active < self.concurrency
+
+
+class AdmissionController(object):
+    '''
+    Bounds concurrent requests overall and per method class. When no slot is free requests
+    wait in a queue ordered by class priority, and are rejected once their class queue is full.
+    '''
+
+    def __init__(self, max_concurrency, classes=None, methods=None, default_class="normal"):
+        super(AdmissionController, self).__init__()
+        self.max_concurrency = max_concurrency
+        self.classes = {
+            name: MethodClass(name, **params)
+            for name, params in (classes or DEFAULT_CLASSES).items()
+        }
+        self.methods = dict(DEFAULT_METHODS if methods is None else methods)
+        self.default_class = default_class
+        self.active = 0
+        self.waiters = []
+        self.counter = itertools.count()
+
+    def classify(self, methods):
+        '''
+        The class of the most expensive method in a (batch) request.
+        '''
+        classes = [
+            self.classes.get(self.methods.get(m, self.default_class), self.classes[self.default_class])
+            for m in methods
+        ] or [self.classes[self.default_class]]
+        return max(classes, key=lambda c: c.priority)
+
+    def slot(self, methods):
+        return _Slot(self, self.classify(methods))
+
+    def _can_run(self, method_class):
+        return self.active < self.max_concurrency and method_class.has_capacity()
+
+    def _grant(self, method_class):
+        self.active += 1
+        method_class.active += 1
+
+    async def acquire(self, method_class):
+        if self._can_run(method_class) and not any(
+                w[0] <= method_class.priority and w[3].has_capacity() for w in self.waiters):
+            self._grant(method_class)
+            return
+        if method_class.queued >= method_class.queue:
+            raise Rejected("too many pending {} requests".format(method_class.name))
+        future = asyncio.get_event_loop().create_future()
+        entry = (method_class.priority, next(self.counter), future, method_class)
+        heapq.heappush(self.waiters, entry)
+        method_class.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(method_class)
+            elif entry in self.waiters:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                method_class.queued -= 1
+            raise
+
+    def release(self, method_class):
+        self.active -= 1
+        method_class.active -= 1
+        self._wake()
+
+    def _wake(self):
+        skipped = []
+        while self.waiters and self.active < self.max_concurrency:
+            entry = heapq.heappop(self.waiters)
+            _, _, future, method_class = entry
+            if future.done():
+                method_class.queued -= 1
+                continue
+            if not method_class.has_capacity():
+                skipped.append(entry)
+                continue
+            method_class.queued -= 1
+            self._grant(method_class)
+            future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self.waiters, entry)
+
+
+class _Slot(object):
+
+    def __init__(self, controller, method_class):
+        self.controller = controller
+        self.method_class = method_class
+
+    async def __aenter__(self):
+        await self.controller.acquire(self.method_class)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.controller.release(self.method_class)
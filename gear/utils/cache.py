@@ -0,0 +1,113 @@
+import os
+import json
+import zlib
+from collections import OrderedDict
+from .types import force_obj_to_text
+
+
+class BytesCache(object):
+    '''
+    LRU cache of byte strings bounded by their total size, kept in memory or, when `path`
+    is given, as one file per key in that directory.
+    '''
+
+    def __init__(self, max_bytes, path=None, max_entry=None):
+        super(BytesCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.max_entry = max_bytes if max_entry is None else max_entry
+        self.path = path
+        self.size = 0
+        self.entries = OrderedDict()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            files = [os.path.join(path, name) for name in os.listdir(path) if not name.endswith(".tmp")]
+            for file in sorted(files, key=os.path.getmtime):
+                self.entries[os.path.basename(file)] = os.path.getsize(file)
+                self.size += self.entries[os.path.basename(file)]
+            self._evict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        if self.path is None:
+            return self.entries[key]
+        try:
+            with open(os.path.join(self.path, key), "rb") as f:
+                return f.read()
+        except OSError:
+            self._remove(key)
+            return None
+
+    def put(self, key, value):
+        if len(value) > self.max_entry:
+            return
+        if key in self.entries:
+            self._remove(key)
+        if self.path is None:
+            self.entries[key] = value
+        else:
+            file = os.path.join(self.path, key)
+            with open(file + ".tmp", "wb") as f:
+                f.write(value)
+            os.replace(file + ".tmp", file)
+            self.entries[key] = len(value)
+        self.size += len(value)
+        self._evict()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        if self.path is None:
+            self.size -= len(entry)
+        else:
+            self.size -= entry
+            try:
+                os.remove(os.path.join(self.path, key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+
+
+class ObjectCache(object):
+    '''
+    Caches JSON-serializable objects as compact JSON bytes, zlib-compressed when `compress`
+    is set, in memory bounded by their total size or in the byte cache `entries`. `get`
+    decodes a fresh copy each time.
+    '''
+
+    def __init__(self, max_bytes, compress=False, entries=None):
+        super(ObjectCache, self).__init__()
+        self.compress = compress
+        self.entries = BytesCache(max_bytes) if entries is None else entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def size(self):
+        return self.entries.size
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            return None
+        # JSON never starts with the zlib header, so readers of a shared cache need not
+        # agree on compression
+        if value[:1] == b"x":
+            value = zlib.decompress(value)
+        return json.loads(value)
+
+    def put(self, key, obj):
+        value = json.dumps(force_obj_to_text(obj, True), separators=(",", ":")).encode("utf-8")
+        if self.compress:
+            value = zlib.compress(value)
+        self.entries.put(key, value)
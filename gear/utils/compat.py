@@ -2,16 +2,16 @@ import rlp
 from hashlib import blake2b
 from eth_keys import keys
 from eth_utils import to_bytes
+from lru import LRU
 from rlp.sedes import (
     CountableList,
     big_endian_int,
     binary
 )
-from .keystore import sha3
+from .keystore import sha3_256
 from .types import (
     bytearray_to_bytestr,
     decode_hex,
-    encode_hex,
     encode_number
 )
 
@@ -69,6 +69,32 @@ def thor_receipt_convert_to_eth_receipt(receipt):
     }
 
 
+#
+# expanded block, `blocks/{revision}?expanded=true` inlines transactions with their receipts
+#
+def expanded_tx_meta(block):
+    return {
+        "blockID": block["id"],
+        "blockNumber": block["number"],
+        "blockTimestamp": block["timestamp"],
+    }
+
+
+def expanded_tx_to_thor_tx(block, tx):
+    result = {k: v for k, v in tx.items() if k not in EXPANDED_RECEIPT_KEYS}
+    result["meta"] = expanded_tx_meta(block)
+    return result
+
+
+def expanded_tx_to_thor_receipt(block, tx):
+    result = {k: tx[k] for k in EXPANDED_RECEIPT_KEYS if k in tx}
+    result["meta"] = dict(expanded_tx_meta(block), txID=tx["id"], txOrigin=tx["origin"])
+    return result
+
+
+EXPANDED_RECEIPT_KEYS = ("gasUsed", "gasPayer", "paid", "reward", "reverted", "outputs")
+
+
 #
 # log
 #
@@ -126,12 +152,30 @@ def thor_tx_convert_to_eth_tx(tx):
 #
 # storage
 #
+# storage key -> keccak(key), shared across debug_storageRangeAt calls
+STORAGE_KEY_HASHES = LRU(65536)
+
+
+def storage_key_hashes(keys):
+    '''
+    Hash a batch of storage keys, serving repeated keys from STORAGE_KEY_HASHES.
+    '''
+    cache = STORAGE_KEY_HASHES
+    result = []
+    for key in keys:
+        hashed = cache.get(key)
+        if hashed is None:
+            raw = key[2:] if key.startswith("0x") else key
+            if len(raw) % 2:
+                raw = "0" + raw
+            hashed = cache[key] = "0x" + sha3_256(bytes.fromhex(raw)).hexdigest()
+        result.append(hashed)
+    return result
+
+
 def thor_storage_convert_to_eth_storage(storage):
-    def _convert_hash(key): return "0x{}".format(encode_hex(sha3(to_bytes(hexstr=key))))
-    return {
-        _convert_hash(v["key"]): v
-        for _, v in storage.items()
-    }
+    values = list(storage.values())
+    return dict(zip(storage_key_hashes([v["key"] for v in values]), values))
 
 
 class Clause(rlp.Serializable):
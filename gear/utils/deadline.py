@@ -0,0 +1,49 @@
+import time
+import contextvars
+
+
+# header a client can use to bound how long it will wait, in seconds
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def start(timeout):
+    return _deadline.set(None if timeout is None else time.monotonic() + timeout)
+
+
+def reset(token):
+    _deadline.reset(token)
+
+
+def remaining(default):
+    '''
+    Time left before the current request's deadline, or `default` when it has none.
+    '''
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(0, deadline - time.monotonic())
+
+
+class Deadlines(object):
+    '''
+    Per-method request timeouts, optionally tightened by the client's DEADLINE_HEADER.
+    '''
+
+    def __init__(self, default=None, methods=None):
+        super(Deadlines, self).__init__()
+        self.default = default
+        self.methods = methods or {}
+
+    def timeout(self, methods, header_value=None):
+        timeouts = [self.methods.get(m, self.default) for m in methods] or [self.default]
+        timeout = None if None in timeouts else max(timeouts)
+        try:
+            requested = float(header_value) if header_value else None
+        except ValueError:
+            requested = None
+        if requested is not None and requested > 0:
+            timeout = requested if timeout is None else min(timeout, requested)
+        return timeout
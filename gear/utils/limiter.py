@@ -0,0 +1,88 @@
+import time
+import asyncio
+import collections
+
+
+class AdaptiveLimiter(object):
+    '''
+    Bounds concurrent upstream requests with a limit adjusted by AIMD: it grows by about one
+    per round of requests while latency stays healthy, and is cut by `backoff` on timeouts,
+    overload responses, or when recent latency exceeds its healthy level by `tolerance`.
+    Requests over the limit wait in a local FIFO queue.
+    '''
+
+    def __init__(self, max_limit, min_limit=1, initial=None, backoff=0.7, tolerance=2.0):
+        super(AdaptiveLimiter, self).__init__()
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial or max(min_limit, max_limit // 4))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.active = 0
+        self.waiters = collections.deque()
+        # moving average of latency in seconds, and its healthy level
+        self.recent = None
+        self.baseline = None
+        self.decreased_at = 0
+
+    def _has_capacity(self):
+        return self.active < int(self.limit)
+
+    async def acquire(self):
+        if self._has_capacity() and not self.waiters:
+            self.active += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self.waiters.remove(future)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self._has_capacity():
+            future = self.waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def _decrease(self):
+        now = time.monotonic()
+        # at most once per typical round trip, a burst of slow responses is one signal
+        if now - self.decreased_at < (self.baseline or 0):
+            return
+        self.decreased_at = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def on_success(self, latency, in_flight):
+        if self.baseline is None:
+            self.recent = self.baseline = latency
+        self.recent += 0.1 * (latency - self.recent)
+        # the lowest recent latency seen, drifting up slowly so it can follow a slower node
+        self.baseline = min(self.recent, self.baseline + 0.001 * (self.recent - self.baseline))
+        if self.recent > self.baseline * self.tolerance:
+            self._decrease()
+        elif in_flight >= int(self.limit):
+            # only grow a limit that is actually in use
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+
+    def on_overload(self):
+        self._decrease()
+
+    def stats(self):
+        return {
+            "limit": int(self.limit),
+            "active": self.active,
+            "queued": len(self.waiters),
+            "latency": self.recent,
+            "baseline": self.baseline,
+        }
@@ -0,0 +1,130 @@
+import os
+import mmap
+import struct
+import hashlib
+import contextlib
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+MAGIC = b"GEARSHM1"
+# magic, index slots, data region size, write position
+HEADER = struct.Struct("<8sQQQ")
+# key hash, position, record length
+SLOT = struct.Struct("<QQI")
+# key length, value length
+RECORD = struct.Struct("<HI")
+BUCKET = 4
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+class SharedCache(object):
+    '''
+    Cache of immutable byte strings in a memory-mapped file that the processes of one host
+    read and write concurrently under `fcntl` file locks. Values are appended to a ring
+    buffer, overwriting the oldest, and found through a hash index of 4-way buckets. An index
+    entry whose record has been overwritten is ignored. The first process sizes the file;
+    later ones use it as it is.
+    '''
+
+    def __init__(self, path, size, slots=None):
+        super(SharedCache, self).__init__()
+        if fcntl is None:
+            raise RuntimeError("shared cache needs fcntl file locks, which this platform lacks")
+        self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+b")
+        with self._lock(fcntl.LOCK_EX):
+            if os.fstat(self.file.fileno()).st_size < HEADER.size:
+                slots = slots or max(BUCKET, size // 512 // BUCKET * BUCKET)
+                data_size = size - HEADER.size - slots * SLOT.size
+                if data_size <= 0:
+                    raise ValueError("shared cache size too small")
+                self.file.truncate(HEADER.size + slots * SLOT.size + data_size)
+                self.file.seek(0)
+                self.file.write(HEADER.pack(MAGIC, slots, data_size, 0))
+                self.file.flush()
+            self.file.seek(0)
+            magic, self.slots, self.data_size, _ = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a shared cache file".format(path))
+        self.index_offset = HEADER.size
+        self.data_offset = HEADER.size + self.slots * SLOT.size
+        self.map = mmap.mmap(self.file.fileno(), self.data_offset + self.data_size)
+
+    @contextlib.contextmanager
+    def _lock(self, operation):
+        fcntl.flock(self.file.fileno(), operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def _write_position(self):
+        return HEADER.unpack_from(self.map, 0)[3]
+
+    def _bucket(self, hashed):
+        first = hashed % (self.slots // BUCKET) * BUCKET
+        return [self.index_offset + (first + i) * SLOT.size for i in range(BUCKET)]
+
+    def _live(self, position, write_position):
+        return position >= write_position - self.data_size
+
+    def _find(self, key, hashed, write_position):
+        for slot in self._bucket(hashed):
+            slot_hash, position, length = SLOT.unpack_from(self.map, slot)
+            if slot_hash != hashed or not self._live(position, write_position):
+                continue
+            offset = self.data_offset + position % self.data_size
+            key_length, value_length = RECORD.unpack_from(self.map, offset)
+            start = offset + RECORD.size
+            if self.map[start:start + key_length] == key:
+                return start + key_length, value_length
+        return None
+
+    @property
+    def size(self):
+        return min(self._write_position(), self.data_size)
+
+    def get(self, key):
+        key = key.encode("utf-8")
+        with self._lock(fcntl.LOCK_SH):
+            found = self._find(key, key_hash(key), self._write_position())
+            if found is None:
+                return None
+            start, length = found
+            return self.map[start:start + length]
+
+    def put(self, key, value):
+        key = key.encode("utf-8")
+        record = RECORD.pack(len(key), len(value)) + key + value
+        if len(record) > self.data_size // 4:
+            return
+        hashed = key_hash(key)
+        with self._lock(fcntl.LOCK_EX):
+            write_position = self._write_position()
+            if self._find(key, hashed, write_position) is not None:
+                return
+            # records never wrap around the end of the ring
+            offset = write_position % self.data_size
+            if offset + len(record) > self.data_size:
+                write_position += self.data_size - offset
+                offset = 0
+            start = self.data_offset + offset
+            self.map[start:start + len(record)] = record
+            slots = self._bucket(hashed)
+            slot = min(slots, key=lambda s: SLOT.unpack_from(self.map, s)[1])
+            for candidate in slots:
+                slot_hash, position, _ = SLOT.unpack_from(self.map, candidate)
+                if slot_hash == 0 or slot_hash == hashed or not self._live(position, write_position):
+                    slot = candidate
+                    break
+            SLOT.pack_into(self.map, slot, hashed, write_position, len(record))
+            HEADER.pack_into(self.map, 0, MAGIC, self.slots, self.data_size, write_position + len(record))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
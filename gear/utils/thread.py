@@ -1,4 +1,9 @@
+import time
+import asyncio
+import functools
+import collections
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 
 class ThreadWithReturn(Thread):
@@ -32,3 +37,88 @@ def spawn(target, *args, **kwargs):
     thread.daemon = True
     thread.start()
     return thread
+
+
+class Offloader(object):
+    '''
+    Runs conversions of results with at least `threshold` items in a worker thread, so the
+    event loop keeps serving other clients in the meantime. Timings are kept in `stats`
+    to help tune the threshold.
+    '''
+
+    def __init__(self, threshold=1000, workers=None):
+        super(Offloader, self).__init__()
+        self.executor = None
+        self.stats = {
+            "inline": 0,
+            "inline_items": 0,
+            "inline_seconds": 0.0,
+            "offloaded": 0,
+            "offloaded_items": 0,
+            "offloaded_seconds": 0.0,
+        }
+        self.configure(threshold, workers)
+
+    def configure(self, threshold, workers=None):
+        self.threshold = threshold
+        self.workers = workers
+
+    async def run(self, size, func, *args, **kwargs):
+        start = time.perf_counter()
+        if self.threshold <= 0 or size < self.threshold:
+            result = func(*args, **kwargs)
+            kind = "inline"
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="offload")
+            result = await asyncio.get_event_loop().run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+            kind = "offloaded"
+        self.stats[kind] += 1
+        self.stats[kind + "_items"] += size
+        self.stats[kind + "_seconds"] += time.perf_counter() - start
+        return result
+
+
+offloader = Offloader()
+
+
+class Worker(object):
+    '''
+    Runs blocking calls, such as SQLite reads and writes, one at a time in a thread of its
+    own, so they neither stall the event loop nor interleave with each other.
+    '''
+
+    def __init__(self, name):
+        super(Worker, self).__init__()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix=name)
+
+    async def run(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def ordered(coros, concurrency):
+    '''
+    Run coroutines with at most `concurrency` of them in flight, yielding their results
+    in order.
+    '''
+    coros = iter(coros)
+    pending = collections.deque()
+    try:
+        for coro in coros:
+            pending.append(asyncio.ensure_future(coro))
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            result = await pending.popleft()
+            for coro in coros:
+                pending.append(asyncio.ensure_future(coro))
+                break
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,67 @@
+import sys
+import time
+import asyncio
+import threading
+import traceback
+import collections
+from .accesslog import access_log
+
+
+class LoopWatchdog(object):
+    '''
+    Measures event loop lag with a heartbeat every `interval` seconds. A watcher thread
+    captures the stack of the loop thread once the heartbeat is `threshold` seconds late,
+    pointing at the code blocking the loop. The last `max_stalls` stalls are kept.
+    '''
+
+    def __init__(self, threshold, interval=0.1, max_stalls=20):
+        super(LoopWatchdog, self).__init__()
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = collections.deque(maxlen=max_stalls)
+        self.stats = {
+            "lag": 0.0,
+            "max_lag": 0.0,
+            "beats": 0,
+            "stalls": 0,
+        }
+        self.beat = None
+        self.loop_thread = None
+        self.stopped = threading.Event()
+
+    async def run(self):
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        watcher.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                self.beat = now = time.monotonic()
+                lag = max(0.0, now - expected)
+                self.stats["lag"] = lag
+                self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+                self.stats["beats"] += 1
+                if lag >= self.threshold and self.stalls and self.stalls[-1]["duration"] is None:
+                    self.stalls[-1]["duration"] = round(lag, 3)
+        finally:
+            self.stopped.set()
+
+    def _watch(self):
+        captured = None
+        while not self.stopped.wait(self.threshold / 4):
+            beat = self.beat
+            if beat == captured or time.monotonic() - beat < self.threshold + self.interval:
+                continue
+            captured = beat
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self.stats["stalls"] += 1
+            self.stalls.append({"time": time.time(), "duration": None, "stack": stack})
+            access_log.error("event loop blocked", stack=stack)
+
+    def report(self):
+        return dict(self.stats, threshold=self.threshold, recent_stalls=list(self.stalls))
@@ -23,16 +23,17 @@ setup(
     license="MIT",
     classifiers=[
         'Intended Audience :: Developers',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
     keywords="thor blockchain ethereum",
     packages=find_packages("."),
     include_package_data=True,
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=[x.strip() for x in open('requirements.txt')],
     entry_points={
         "console_scripts": [
             "web3-gear=gear.cli:run_server",
+            "web3-gear-replay=gear.replay:run_replay",
         ],
     }
 )